@@ -0,0 +1,168 @@
+import argparse
+import logging
+import os
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+import commit_file
+from git_runner import Watchdog, kill_group
+from schedule_commit import plan_run_times
+from updater import Updater, default_repo_path, segment_path, trim_to_fit, update_text
+
+def plan_backfill_times(start, end):
+    # Same random model as schedule_commit.py, applied to each day in [start, end)
+    run_times = []
+    day = start
+    while day < end:
+        run_times.extend(t for t in plan_run_times(day) if t < end)
+        day += timedelta(days=1)
+    return sorted(run_times)
+
+def get_identity(session):
+    name = session.run(['git', 'config', 'user.name'], check=True, capture_output=True,
+                       text=True, timeout=session.config.GIT_TIMEOUT).stdout.strip()
+    email = session.run(['git', 'config', 'user.email'], check=True, capture_output=True,
+                        text=True, timeout=session.config.GIT_TIMEOUT).stdout.strip()
+    return f'{name} <{email}>'
+
+def format_git_date(run_time):
+    timestamp = int(run_time.timestamp())
+    return f"{timestamp} {time.strftime('%z', time.localtime(timestamp))}"
+
+def data_command(payload):
+    return f'data {len(payload)}\n'.encode() + payload + b'\n'
+
+def write_commit_stream(session, stream, branch, parent, identity, run_times, files, segments, contents, modes):
+    plans = [(run_time, dict(session.plan_file_updates(files)), session.next_commit_message())
+             for run_time in run_times]
+    max_file_size = session.config.MAX_FILE_SIZE
+
+    # Write every version of one file before moving on to the next, so each
+    # blob is stored as a delta against the previous version of the same file
+    blob_marks = {}
+    mark = 0
+    for file in files:
+        path = segment_path(file, segments[file])
+        data = bytearray(contents[path])
+        for index, (_, updates, _) in enumerate(plans):
+            if file not in updates:
+                continue
+            text = update_text(updates[file])
+            # Same size policy as rotate_target(), applied in memory
+            if max_file_size and len(data) + len(text) > max_file_size:
+                if session.config.ROTATION_POLICY == 'segment':
+                    if data:
+                        contents[path] = bytes(data)
+                        segments[file] += 1
+                        path = segment_path(file, segments[file])
+                        data = bytearray()
+                else:
+                    data = bytearray(trim_to_fit(bytes(data), len(text), max_file_size))
+            data += text
+            mark += 1
+            blob_marks[index, file] = (mark, path)
+            stream.write(f'blob\nmark :{mark}\n'.encode())
+            stream.write(data_command(bytes(data)))
+        contents[path] = bytes(data)
+
+    for index, (run_time, updates, message) in enumerate(plans):
+        date = format_git_date(run_time)
+        mark += 1
+        stream.write(f'commit refs/heads/{branch}\nmark :{mark}\n'.encode())
+        stream.write(f'author {identity} {date}\ncommitter {identity} {date}\n'.encode())
+        stream.write(data_command(message.encode()))
+        if index == 0 and parent:
+            stream.write(f'from {parent}\n'.encode())
+        for file in updates:
+            blob_mark, path = blob_marks[index, file]
+            stream.write(f'M {modes[file]} :{blob_mark} {path}\n'.encode())
+        stream.write(b'\n')
+    stream.write(b'done\n')
+
+def backfill(session, start, end, push=True):
+    state = session.get_repo_state()
+    if not state.is_repo:
+        raise Exception("Not a git repository")
+    if state.branch is None:
+        raise Exception("Cannot backfill a detached HEAD")
+    if state.dirty:
+        raise Exception("Working directory is not clean. Please commit or stash changes before backfilling.")
+
+    run_times = plan_backfill_times(start, end)
+    if not run_times:
+        logging.info(f"No runs planned between {start} and {end}; nothing to backfill.")
+        return 0
+    logging.info(f"Backfilling {len(run_times)} commits between {start} and {end}")
+
+    files = sorted(session.list_update_files())
+    segments = {}
+    contents = {}
+    modes = {}
+    for file in files:
+        segments[file] = session.active_segment(file) if session.config.ROTATION_POLICY == 'segment' else 0
+        path = segment_path(file, segments[file])
+        with open(session.repo_path(path), 'rb') as f:
+            contents[path] = f.read()
+        modes[file] = '100755' if os.access(session.repo_path(file), os.X_OK) else '100644'
+
+    # One fast-import process writes the whole history into a single pack. It
+    # gets its own process group, killed if it is still running when the
+    # session's time limit is up.
+    identity = get_identity(session)
+    timeout = session.git.timeout_for(None)
+    start = time.monotonic()
+    fast_import = subprocess.Popen(['git', 'fast-import', '--quiet', '--done'],
+                                   stdin=subprocess.PIPE, cwd=session.path, start_new_session=True)
+    with Watchdog(fast_import, timeout) as watchdog:
+        try:
+            try:
+                write_commit_stream(session, fast_import.stdin, state.branch, state.head, identity,
+                                    run_times, files, segments, contents, modes)
+            finally:
+                fast_import.stdin.close()
+        except BrokenPipeError:
+            pass  # fast-import exited or was killed; its exit status says which
+        except BaseException:
+            kill_group(fast_import)
+            fast_import.wait()
+            raise
+        fast_import.wait()
+    session.git.record_command(fast_import.args, time.monotonic() - start,
+                               'timeout' if watchdog.expired else fast_import.returncode)
+    if watchdog.expired:
+        raise subprocess.TimeoutExpired(fast_import.args, timeout)
+    if fast_import.returncode != 0:
+        raise Exception(f"git fast-import failed with exit status {fast_import.returncode}")
+
+    # Bring the working tree and index up to the new branch tip
+    for path, data in contents.items():
+        with open(session.repo_path(path), 'wb') as f:
+            f.write(data)
+    session.run(['git', 'reset', '-q'], check=True, timeout=session.config.GIT_TIMEOUT)
+    logging.info(f"Imported {len(run_times)} commits onto {state.branch}")
+
+    if push:
+        session.run_git(['git', 'push'], check=True)
+        logging.info("Backfilled commits pushed successfully.")
+    return len(run_times)
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a range of historical commits with git fast-import.")
+    parser.add_argument('--from', dest='start', type=parse_date, required=True, help="first day, YYYY-MM-DD")
+    parser.add_argument('--to', dest='end', type=parse_date, required=True, help="day after the last day, YYYY-MM-DD")
+    parser.add_argument('--no-push', action='store_true', help="leave the commits local")
+    parser.add_argument('--repo', default=default_repo_path(), help="repository to backfill")
+    args = parser.parse_args()
+    repo_path = os.path.abspath(args.repo)
+    commit_file.setup_logging(repo_path)
+    try:
+        with Updater(repo_path) as session, session.get_run_lock():
+            count = backfill(session, args.start, args.end, push=not args.no_push)
+        print(f"Backfilled {count} commits.")
+    except Exception as e:
+        logging.error(f"An error occurred during backfill: {e}", exc_info=True)
+        raise SystemExit(1)
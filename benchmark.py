@@ -0,0 +1,272 @@
+import argparse
+import glob
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import payload
+
+# End-to-end benchmark: each scenario gets a fresh clone of a local bare
+# "origin", seeded with the update files and history it asks for, and runs
+# the real commit_file.py pipeline in it, one process per run as the at jobs
+# do. Latency is measured around the whole process; git subprocess counts
+# come from the metrics.jsonl the runs write.
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_FILES = ['*.py', 'commit_messages.txt', '.gitignore']
+
+# Runs one commit cycle with the file size limit the scenario asks for
+RUNNER = (
+    "import os, sys, commit_file, updater\n"
+    "commit_file.setup_logging(os.getcwd())\n"
+    "with updater.Updater(os.getcwd(), MAX_FILE_SIZE=int(sys.argv[1])) as session:\n"
+    "    sys.exit(0 if session.run_commit_cycle() else 1)\n"
+)
+
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+def parse_size(value):
+    value = value.strip().upper()
+    for unit in sorted(SIZE_UNITS, key=len, reverse=True):
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(value)
+
+def format_size(size):
+    for unit in ('GB', 'MB', 'KB'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f'{size // SIZE_UNITS[unit]}{unit}'
+    return f'{size}B'
+
+def percentile(values, pct):
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def git(args, cwd, **kwargs):
+    return subprocess.run(['git'] + args, cwd=cwd, check=True, capture_output=True, text=True, **kwargs)
+
+def repo_size(path):
+    # Loose and packed object bytes, as reported by git count-objects
+    output = git(['count-objects', '-v'], cwd=path).stdout
+    counts = dict(line.split(': ') for line in output.splitlines())
+    return (int(counts['size']) + int(counts['size-pack'])) * 1024
+
+def write_random_file(path, size):
+    # Printable text like the updates the pipeline appends
+    with open(path, 'wb') as f:
+        payload.write_random_bytes(f, size)
+
+def write_history(work, depth):
+    # depth small commits through one fast-import, touching a separate file
+    parent = git(['rev-parse', 'HEAD'], cwd=work).stdout.strip()
+    stream = []
+    for number in range(depth):
+        message = f'History {number}\n'
+        content = f'{number}\n'
+        stream.append(f'commit refs/heads/main\n'
+                      f'committer Benchmark <benchmark@example.com> {1600000000 + number} +0000\n'
+                      f'data {len(message)}\n{message}'.encode())
+        if number == 0:
+            stream.append(f'from {parent}\n'.encode())
+        stream.append(f'M 100644 inline history.txt\ndata {len(content)}\n{content}\n'.encode())
+    stream.append(b'done\n')
+    subprocess.run(['git', 'fast-import', '--quiet', '--done'], cwd=work, check=True, input=b''.join(stream))
+    git(['reset', '-q', '--hard'], cwd=work)
+
+def build_repo(root, file_size, file_count, history):
+    origin = os.path.join(root, 'origin.git')
+    work = os.path.join(root, 'work')
+    git(['init', '-q', '--bare', '-b', 'main', origin], cwd=root)
+    git(['clone', '-q', origin, work], cwd=root)
+    git(['checkout', '-q', '-b', 'main'], cwd=work)
+    git(['config', 'user.name', 'Benchmark'], cwd=work)
+    git(['config', 'user.email', 'benchmark@example.com'], cwd=work)
+
+    for pattern in SOURCE_FILES:
+        for path in glob.glob(os.path.join(SOURCE_DIR, pattern)):
+            if os.path.basename(path) != 'benchmark.py':
+                shutil.copy(path, work)
+    os.makedirs(os.path.join(work, 'update_files'))
+    for number in range(1, file_count + 1):
+        write_random_file(os.path.join(work, 'update_files', f'file.bench{number}'), file_size)
+    git(['add', '-A'], cwd=work)
+    git(['commit', '-q', '-m', 'Benchmark baseline'], cwd=work)
+    if history:
+        write_history(work, history)
+    git(['push', '-q', '-u', 'origin', 'main'], cwd=work)
+    git(['gc', '-q'], cwd=work)
+    return work
+
+def read_metrics(work):
+    path = os.path.join(work, '.git', 'github_updater', 'metrics.jsonl')
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+    except FileNotFoundError:
+        return []
+
+def run_scenario(file_size, file_count, history, runs, max_file_size):
+    name = f'size={format_size(file_size)},files={file_count},history={history}'
+    print(f'{name}: preparing', file=sys.stderr)
+    root = tempfile.mkdtemp(prefix='github_updater_bench_')
+    try:
+        work = os.path.realpath(build_repo(root, file_size, file_count, history))
+        commits_before = int(git(['rev-list', '--count', 'HEAD'], cwd=work).stdout)
+        size_before = repo_size(work)
+
+        latencies = []
+        failures = 0
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, '-c', RUNNER, str(max_file_size)], cwd=work,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            latencies.append(time.perf_counter() - start)
+            failures += result.returncode != 0
+
+        commits = int(git(['rev-list', '--count', 'HEAD'], cwd=work).stdout) - commits_before
+        growth = repo_size(work) - size_before
+        records = [record for record in read_metrics(work) if record['outcome'] == 'success']
+        phases = {}
+        for record in records:
+            for entry in record['phases']:
+                phases[entry['phase']] = phases.get(entry['phase'], 0.0) + entry['seconds']
+        print(f'{name}: p50 {percentile(latencies, 50):.3f}s over {runs} runs', file=sys.stderr)
+        return {
+            'name': name,
+            'file_size': file_size,
+            'files': file_count,
+            'history': history,
+            'runs': runs,
+            'failures': failures,
+            'latency': {
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'mean': sum(latencies) / len(latencies),
+            },
+            'git_commands_per_run': (sum(len(record['commands']) for record in records) / len(records)
+                                     if records else None),
+            'phase_seconds_per_run': {phase: seconds / len(records) for phase, seconds in sorted(phases.items())},
+            'commits': commits,
+            'growth_per_commit': growth / commits if commits else None,
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def get_version():
+    try:
+        return git(['describe', '--always', '--dirty'], cwd=SOURCE_DIR).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+def compare(results, baseline, threshold):
+    # A scenario regresses when its p50 or p95 is more than threshold slower
+    regressions = []
+    previous = {scenario['name']: scenario for scenario in baseline['scenarios']}
+    for scenario in results['scenarios']:
+        old = previous.get(scenario['name'])
+        if not old:
+            continue
+        for key in ('p50', 'p95'):
+            ratio = scenario['latency'][key] / old['latency'][key]
+            status = 'REGRESSION' if ratio > 1 + threshold else 'ok'
+            print(f"{scenario['name']} {key}: {old['latency'][key]:.3f}s -> "
+                  f"{scenario['latency'][key]:.3f}s ({ratio - 1:+.1%}) {status}")
+            if status != 'ok':
+                regressions.append((scenario['name'], key, ratio))
+    return regressions
+
+def choices_text(length):
+    # generate_random_text before payload.py, kept as the baseline
+    return ''.join(random.choices(string.ascii_letters + string.digits + string.punctuation + ' ', k=length))
+
+def time_call(func):
+    number, total = timeit.Timer(func).autorange()
+    return total / number
+
+def run_payload_benchmark(sizes):
+    results = []
+    with open(os.devnull, 'wb') as devnull:
+        for size in sizes:
+            print(f'payload {format_size(size)}: timing', file=sys.stderr)
+            results.append({
+                'size': size,
+                'choices': time_call(lambda: choices_text(size)),
+                'bulk': time_call(lambda: payload.random_text(size)),
+                'streamed': time_call(lambda: payload.write_random_bytes(devnull, size)),
+            })
+    return results
+
+def print_payload_report(results):
+    print(f"{'size':>8} {'random.choices':>16} {'random_text':>16} {'streamed':>16} {'speedup':>8}")
+    for entry in results:
+        cells = [f"{entry[key] * 1000:>9.3f}ms {entry['size'] / entry[key] / 1024 ** 2:>4.0f}MB/s"
+                 for key in ('choices', 'bulk', 'streamed')]
+        print(f"{format_size(entry['size']):>8} {cells[0]:>16} {cells[1]:>16} {cells[2]:>16} "
+              f"{entry['choices'] / entry['bulk']:>7.1f}x")
+
+def print_report(results):
+    print(f"{'scenario':<40} {'p50':>8} {'p95':>8} {'p99':>8} {'git/run':>8} {'growth/commit':>14} {'failed':>6}")
+    for scenario in results['scenarios']:
+        latency = scenario['latency']
+        commands = scenario['git_commands_per_run']
+        growth = scenario['growth_per_commit']
+        print(f"{scenario['name']:<40} {latency['p50']:>7.3f}s {latency['p95']:>7.3f}s {latency['p99']:>7.3f}s "
+              f"{'-' if commands is None else f'{commands:.1f}':>8} "
+              f"{'-' if growth is None else f'{growth / 1024:.1f}KB':>14} {scenario['failures']:>6}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the commit_file.py pipeline against a local bare repository.")
+    parser.add_argument('--runs', type=int, default=20, help="pipeline runs per scenario")
+    parser.add_argument('--sizes', default='1KB,1MB', help="comma-separated update file sizes, e.g. 1KB,1MB,50MB")
+    parser.add_argument('--files', default='1,10', help="comma-separated numbers of update files")
+    parser.add_argument('--history', default='0,1000', help="comma-separated numbers of existing commits")
+    parser.add_argument('--max-file-size', type=parse_size, default=0,
+                        help="MAX_FILE_SIZE for the runs; the default 0 keeps rotation out of the measurement")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier benchmark to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown before flagging, 0.2 = 20%%")
+    parser.add_argument('--payload', action='store_true',
+                        help="instead of the pipeline, time random text generation for each of --sizes")
+    args = parser.parse_args()
+
+    results = {
+        'version': get_version(),
+        'created': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'max_file_size': args.max_file_size,
+        'scenarios': [],
+    }
+    if args.payload:
+        results['payload'] = run_payload_benchmark([parse_size(size) for size in args.sizes.split(',')])
+        print_payload_report(results['payload'])
+        grid = []
+    else:
+        grid = itertools.product([parse_size(size) for size in args.sizes.split(',')],
+                                 [int(count) for count in args.files.split(',')],
+                                 [int(depth) for depth in args.history.split(',')])
+    for file_size, file_count, history in grid:
+        results['scenarios'].append(run_scenario(file_size, file_count, history, args.runs, args.max_file_size))
+    if results['scenarios']:
+        print_report(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,88 @@
+import heapq
+import logging
+import signal
+import threading
+from datetime import datetime, timedelta
+
+import commit_file
+import events
+from run_lock import RunLockTimeout
+from schedule_commit import plan_run_times
+from updater import PushRejected, Updater, default_repo_path
+
+# Longest single sleep, so clock changes are noticed
+MAX_SLEEP = 60  # seconds
+# Runs due within this many seconds of each other share one pull and push
+COALESCE_WINDOW = 30  # seconds
+
+_stop_requested = threading.Event()
+
+def request_stop(signum, frame):
+    logging.info(f"Received signal {signum}, stopping commit daemon after the current run.")
+    _stop_requested.set()
+
+def schedule_day(session, heap, start):
+    run_times = plan_run_times(start)
+    for run_time in run_times:
+        run_id = events.new_run_id()
+        heapq.heappush(heap, (run_time, run_id))
+        events.emit(session.events_file, 'run_scheduled', run_id, scheduled_at=run_time.timestamp(),
+                    scheduler='commit_daemon')
+    logging.info(f"Planned {len(run_times)} runs between {start} and {start + timedelta(days=1)}")
+    return start + timedelta(days=1)
+
+def run_daemon(session):
+    # One session for the daemon's whole life, so the git processes and the
+    # message index are set up once
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    logging.info("commit_daemon.py started.")
+    heap = []
+    next_planning = schedule_day(session, heap, datetime.now())
+    # Set when the remote rejected an idle push; the queue then waits for the
+    # next run, which pulls before it pushes
+    push_rejected = False
+
+    while not _stop_requested.is_set():
+        now = datetime.now()
+        if now >= next_planning:
+            next_planning = schedule_day(session, heap, next_planning)
+            continue
+
+        # Run everything that is due, oldest first
+        if heap and heap[0][0] <= now:
+            run_time, run_id = heapq.heappop(heap)
+            commits = 1
+            while (heap and heap[0][0] - run_time <= timedelta(seconds=COALESCE_WINDOW)
+                   and commits < session.config.MAX_COALESCED_COMMITS):
+                merged_time, merged_id = heapq.heappop(heap)
+                events.emit(session.events_file, 'run_merged', merged_id,
+                            scheduled_at=merged_time.timestamp(), into=run_id)
+                commits += 1
+            logging.info(f"Running commit cycle scheduled for {run_time} with {commits} commit(s)")
+            session.run_commit_cycle(commits, run_id=run_id, scheduled_at=run_time.timestamp())
+            push_rejected = False
+            continue
+
+        # Drain the push queue on time even when no run is due
+        if not push_rejected and session.push_queue_due():
+            try:
+                with session.get_run_lock():
+                    session.flush_push_queue()
+            except RunLockTimeout as e:
+                logging.error(f"Skipping push queue flush: {e}")
+            except PushRejected as e:
+                logging.error(f"{e}; leaving the push to the next scheduled run")
+                push_rejected = True
+
+        next_event = min(heap[0][0], next_planning) if heap else next_planning
+        _stop_requested.wait(min(MAX_SLEEP, max(0, (next_event - now).total_seconds())))
+
+    logging.info("commit_daemon.py stopped.")
+
+if __name__ == "__main__":
+    repo_path = default_repo_path()
+    commit_file.setup_logging(repo_path)
+    with Updater(repo_path) as session:
+        run_daemon(session)
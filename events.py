@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+
+import log_setup
+
+# Structured events, one JSON object per line, shared by the scheduler, the
+# runner and the daemon. Every event of one scheduled run carries the same
+# run_id, so e.g. schedule-to-start lag is the difference between the
+# started and scheduled_at fields of its run_started event.
+
+RUN_ID_ENV = 'GITHUB_UPDATER_RUN_ID'
+SCHEDULED_AT_ENV = 'GITHUB_UPDATER_SCHEDULED_AT'
+MAX_BYTES = 5 * 1024 * 1024  # the file is gzipped to <file>.1.gz when it reaches this, 0 never
+BACKUP_COUNT = 14  # gzipped copies kept
+
+def new_run_id():
+    return uuid.uuid4().hex[:16]
+
+def emit(path, event, run_id=None, **fields):
+    # Rotated like the logs, so the file stops growing at MAX_BYTES
+    record = {'time': time.time(), 'event': event, 'run_id': run_id,
+              'host': socket.gethostname(), 'pid': os.getpid()}
+    record.update(fields)
+    line = (json.dumps(record) + '\n').encode()
+    try:
+        log_setup.rotate_file(path, MAX_BYTES, BACKUP_COUNT)
+        # One O_APPEND write per event keeps lines from different processes whole
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logging.warning(f"Could not write {event} event to {path}: {e}")
+    return record
+
+def read_events(path):
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+    except FileNotFoundError:
+        return
+
+def run_from_environment():
+    # The run ID and scheduled time the scheduler passed to this process, if any
+    run_id = os.environ.get(RUN_ID_ENV) or None
+    try:
+        scheduled_at = float(os.environ[SCHEDULED_AT_ENV])
+    except (KeyError, ValueError):
+        scheduled_at = None
+    return run_id, scheduled_at
@@ -0,0 +1,221 @@
+import asyncio
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+
+# Runs git commands as asyncio subprocesses. Every command starts in its own
+# session (process group), so when its time is up the whole group is killed:
+# git together with the ssh or remote helper it started, which would
+# otherwise keep the pipes open and the run waiting. A run can be given a
+# deadline; each command then gets at most the time left of it, so a run
+# cannot take much longer than its budget however many commands it makes.
+# The long-lived processes of the plumbing engine and fast-import follow the
+# same rules through PipeProcess and Watchdog.
+
+def kill_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+async def gather_fail_fast(*awaitables):
+    # Like asyncio.gather, but the first failure cancels the others, which
+    # kills any command they are running
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+class Deadline:
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+class PipeProcess:
+    # A long-lived git process answering requests on stdin/stdout, such as
+    # 'hash-object --stdin-paths' or 'cat-file --batch'. Reads go through
+    # select with the time limit given to start_request(); a request not
+    # answered in time kills the process group and raises TimeoutExpired.
+
+    def __init__(self, args, cwd=None):
+        self.args = args
+        self.proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                     cwd=cwd, start_new_session=True)
+        self._buffer = bytearray()
+        self._timeout = None
+        self._deadline = None
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def start_request(self, timeout):
+        self._timeout = timeout
+        self._deadline = None if timeout is None else time.monotonic() + timeout
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def _fill(self):
+        # Read what the process has written so far; False at end of output
+        fd = self.proc.stdout.fileno()
+        remaining = None if self._deadline is None else max(0, self._deadline - time.monotonic())
+        if not select.select([fd], [], [], remaining)[0]:
+            self.kill()
+            raise subprocess.TimeoutExpired(self.args, self._timeout)
+        chunk = os.read(fd, 65536)
+        self._buffer += chunk
+        return bool(chunk)
+
+    def readline(self):
+        while b'\n' not in self._buffer:
+            if not self._fill():
+                break
+        end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        line = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return line
+
+    def read(self, size):
+        while len(self._buffer) < size:
+            if not self._fill():
+                break
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def error_output(self):
+        # Only once the process has exited
+        return self.proc.stderr.read().decode(errors='replace').strip()
+
+    def kill(self):
+        kill_group(self.proc)
+        self.proc.wait()
+
+    def close(self, timeout=None):
+        if self.alive():
+            self.proc.stdin.close()
+            try:
+                self.proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.kill()
+
+class Watchdog:
+    # Kills a process's group if it is still running after `timeout` seconds,
+    # for processes fed through a pipe, where a blocked write cannot time out
+    # by itself
+
+    def __init__(self, proc, timeout):
+        self.proc = proc
+        self.expired = False
+        self._timer = threading.Timer(timeout, self._expire) if timeout is not None else None
+
+    def _expire(self):
+        self.expired = True
+        kill_group(self.proc)
+
+    def __enter__(self):
+        if self._timer is not None:
+            self._timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._timer is not None:
+            self._timer.cancel()
+
+class GitRunner:
+    # run() takes the subprocess.run arguments the pipeline uses (check,
+    # capture_output, stdout, stderr, input, text, timeout, cwd), returns a
+    # subprocess.CompletedProcess and raises CalledProcessError and
+    # TimeoutExpired as subprocess.run does. Commands are recorded in
+    # run_metrics. One runner belongs to one thread at a time.
+
+    def __init__(self, run_metrics, cwd=None, default_timeout=None):
+        self.metrics = run_metrics
+        self.cwd = cwd
+        self.default_timeout = default_timeout  # for commands given no timeout outside a deadline
+        self.deadline = None
+        self._loop = None
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.close()
+            self._loop = None
+
+    def start_deadline(self, seconds):
+        self.deadline = Deadline(seconds) if seconds else None
+
+    def clear_deadline(self):
+        self.deadline = None
+
+    def record_command(self, args, seconds, exit_code):
+        self.metrics.record_command(args, seconds, exit_code)
+
+    def timeout_for(self, timeout):
+        if self.deadline is None:
+            return timeout if timeout is not None else self.default_timeout
+        remaining = self.deadline.remaining()
+        return remaining if timeout is None else min(timeout, remaining)
+
+    async def run_async(self, args, check=False, capture_output=False, stdout=None, stderr=None, input=None,
+                        text=False, timeout=None, cwd=None):
+        if capture_output:
+            stdout = stderr = subprocess.PIPE
+        if text and input is not None:
+            input = input.encode()
+        timeout = self.timeout_for(timeout)
+        start = time.monotonic()
+        exit_code = None
+        try:
+            if timeout is not None and timeout <= 0:
+                exit_code = 'timeout'
+                raise subprocess.TimeoutExpired(args, 0)
+            proc = await asyncio.create_subprocess_exec(
+                *args, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                stdout=stdout, stderr=stderr, cwd=cwd or self.cwd, start_new_session=True)
+            try:
+                out, err = await asyncio.wait_for(proc.communicate(input), timeout)
+            except asyncio.TimeoutError:
+                kill_group(proc)
+                await proc.wait()
+                exit_code = 'timeout'
+                raise subprocess.TimeoutExpired(args, timeout)
+            except BaseException:
+                # Cancelled because a command running alongside failed
+                kill_group(proc)
+                await proc.wait()
+                raise
+            exit_code = proc.returncode
+        finally:
+            self.record_command(args, time.monotonic() - start, exit_code)
+
+        if text:
+            out = out.decode(errors='replace') if out is not None else None
+            err = err.decode(errors='replace') if err is not None else None
+        if check and proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, args, out, err)
+        return subprocess.CompletedProcess(args, proc.returncode, out, err)
+
+    async def run_all_async(self, commands):
+        # Runs (args, kwargs) pairs at the same time; results come back in order
+        return await gather_fail_fast(*(self.run_async(args, **kwargs) for args, kwargs in commands))
+
+    def run_coroutine(self, coroutine):
+        # Runs a coroutine that uses this runner on the runner's event loop
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coroutine)
+
+    def run(self, args, **kwargs):
+        return self.run_coroutine(self.run_async(args, **kwargs))
@@ -0,0 +1,169 @@
+import fcntl
+import gzip
+import logging
+import logging.handlers
+import os
+import shutil
+import sys
+import time
+from collections import deque
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# For processes working on several repositories at once; the thread is named after the repository
+THREAD_LOG_FORMAT = '%(asctime)s - %(levelname)s - [%(threadName)s] %(message)s'
+
+# Environment variables worth having in the log; the rest of os.environ is
+# noise at best and secrets at worst
+LOGGED_ENV_KEYS = ['USER', 'LOGNAME', 'HOME', 'PWD', 'SHELL', 'PATH', 'LANG',
+                   'GITHUB_UPDATER_HOME', 'GITHUB_UPDATER_LOG_LEVEL']
+
+def compress_file(source, dest):
+    try:
+        with open(source, 'rb') as f_in, gzip.open(f'{dest}.tmp', 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    except FileNotFoundError:
+        return  # another process rotated it first
+    os.replace(f'{dest}.tmp', dest)
+    os.remove(source)
+
+def rotate_file(path, max_bytes, backup_count=7):
+    # The handler's size policy for files that many processes append to a
+    # line at a time (events.jsonl, metrics.jsonl): once `path` has reached
+    # max_bytes it is gzipped to <path>.1.gz and older copies move up one,
+    # keeping backup_count of them. Returns True if it rotated the file.
+    try:
+        if not max_bytes or os.path.getsize(path) < max_bytes:
+            return False
+    except FileNotFoundError:
+        return False
+    # One rotation at a time; the first process in rotates, the rest find a
+    # small new file when they get the lock
+    with open(f'{path}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.getsize(path) < max_bytes:
+                return False
+            rotating = f'{path}.rotating'
+            os.rename(path, rotating)
+        except FileNotFoundError:
+            return False
+        for number in range(max(1, backup_count) - 1, 0, -1):
+            if os.path.exists(f'{path}.{number}.gz'):
+                os.replace(f'{path}.{number}.gz', f'{path}.{number + 1}.gz')
+        compress_file(rotating, f'{path}.1.gz')
+    return True
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    # Starts a new file when the current one would pass max_bytes, or when it
+    # was last written in an earlier interval (e.g. yesterday, for 86400).
+    # Rotated files are gzipped to <name>.1.gz ... <name>.<backup_count>.gz.
+    # Several processes append to the same file, so the file is reopened
+    # when another process has rotated it.
+
+    def __init__(self, filename, max_bytes=0, interval=0, backup_count=7):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=max(1, backup_count), encoding='utf-8')
+        self.interval = interval
+        self.namer = lambda name: f'{name}.gz'
+        self.rotator = compress_file
+
+    def _period(self, timestamp):
+        # Intervals start at local midnight
+        return int((timestamp + time.localtime(timestamp).tm_gmtoff) // self.interval)
+
+    def _reopen_if_rotated(self):
+        if self.stream is None:
+            return
+        try:
+            current = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            current = None
+        opened = os.fstat(self.stream.fileno())
+        if current is None or (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+            self.stream.close()
+            self.stream = self._open()
+
+    def shouldRollover(self, record):
+        if self.interval and self.stream is not None:
+            stat = os.fstat(self.stream.fileno())
+            if stat.st_size and self._period(stat.st_mtime) != self._period(record.created):
+                return True
+        return super().shouldRollover(record)
+
+    def emit(self, record):
+        try:
+            self._reopen_if_rotated()
+        except OSError:
+            self.handleError(record)
+            return
+        super().emit(record)
+
+class RingBufferHandler(logging.Handler):
+    # Passes records at pass_level and above straight to target and keeps
+    # the last `capacity` records below it in memory. They are written out,
+    # oldest first, just before the next record at flush_level or above, so
+    # the log carries the detail leading up to an error and nothing more
+    # for runs that go well.
+
+    def __init__(self, target, capacity, pass_level=logging.INFO, flush_level=logging.ERROR):
+        super().__init__(logging.DEBUG)
+        self.target = target
+        self.buffer = deque(maxlen=capacity)
+        self.pass_level = pass_level
+        self.flush_level = flush_level
+
+    def emit(self, record):
+        if record.levelno >= self.flush_level:
+            self.flush_buffer()
+        if record.levelno >= self.pass_level:
+            self.target.handle(record)
+        else:
+            self.buffer.append(record)
+
+    def flush_buffer(self):
+        while self.buffer:
+            self.target.handle(self.buffer.popleft())
+
+    def discard(self):
+        self.buffer.clear()
+
+    def close(self):
+        self.target.close()
+        super().close()
+
+def discard_buffered_records():
+    # Called when a run is over, so a later error only brings out the detail
+    # of the run it happened in
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, RingBufferHandler):
+            handler.discard()
+
+def log_uncaught_exceptions():
+    previous_hook = sys.excepthook
+
+    def hook(exc_type, exc, tb):
+        # Logged at CRITICAL, which also writes out the buffered records
+        logging.critical("Uncaught exception", exc_info=(exc_type, exc, tb))
+        previous_hook(exc_type, exc, tb)
+
+    sys.excepthook = hook
+
+def setup_logging(filename, level='INFO', max_bytes=5 * 1024 * 1024, interval=86400, backup_count=14,
+                  buffer_size=0, log_format=LOG_FORMAT):
+    # With buffer_size, records below `level` are kept in a ring buffer of
+    # that size and only written when an error is logged
+    handler = CompressingRotatingFileHandler(filename, max_bytes=max_bytes, interval=interval,
+                                             backup_count=backup_count)
+    handler.setFormatter(logging.Formatter(log_format))
+    level_number = logging.getLevelName(level.upper())
+    if not isinstance(level_number, int):
+        raise ValueError(f"Unknown log level: {level}")
+    level = level_number
+    if buffer_size and level > logging.DEBUG:
+        handler = RingBufferHandler(handler, buffer_size, pass_level=level)
+        level = logging.DEBUG
+        log_uncaught_exceptions()
+    logging.basicConfig(handlers=[handler], level=level)
+    return handler
+
+def environment_summary(keys=LOGGED_ENV_KEYS):
+    return {key: os.environ[key] for key in keys if key in os.environ}
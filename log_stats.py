@@ -0,0 +1,196 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+
+# Streams commit_output.log and its rotated .gz files, oldest first, one line
+# at a time, so memory does not grow with the size of the logs. Runs are
+# delimited by "Starting main process"; lines without a timestamp (git
+# output, tracebacks) belong to the run that is open when they appear.
+
+LINE_RE = re.compile(r'^(\d{4}-\d{2}-\d{2}) \d{2}:\d{2}:\d{2},\d+ - ([A-Z]+) - (.*)$')
+
+# Checked in this order; a failed run gets the first class any of its lines matches
+FAILURE_CLASSES = [
+    ('index_lock', re.compile(r'index\.lock|Another git process seems to be running')),
+    ('merge_conflict', re.compile(r'Merge conflicts? detected|CONFLICT \(|could not apply|Resolve all conflicts')),
+    ('push_rejected', re.compile(r'\[(remote )?rejected\]|failed to push some refs|Updates were rejected'
+                                 r'|non-fast-forward')),
+    ('network_timeout', re.compile(r'timed out|Could not resolve host|Connection (refused|reset)'
+                                   r'|unable to access|Could not read from remote repository'
+                                   r'|Cannot access remote repository|Network is unreachable', re.IGNORECASE)),
+]
+
+START_MARKER = 'Starting main process in commit_file.py'
+SUCCESS_MARKERS = ('Main process in commit_file.py completed successfully.', 'Run success after')
+FAILURE_MARKERS = ('An error occurred in the main process', 'Run failed after')
+# Written by runs that never start a main process of their own
+SKIPPED_MARKERS = ('Skipping this run:',)
+COALESCED_MARKERS = ('Run coalesced after',)
+# A merged run whose commit the run holding the lock failed to make
+MERGED_FAILURE_MARKERS = ('Merged run failed after',)
+# Commits made by the pipeline; auto-commits of stray changes (often the log
+# itself) are not counted
+COMMIT_MARKERS = ('Files committed',)
+
+def classify(text):
+    for name, pattern in FAILURE_CLASSES:
+        if pattern.search(text):
+            return name
+    return None
+
+def log_files(path):
+    # <log>.N.gz is older the larger N is; the live log comes last
+    rotated = []
+    for name in glob.glob(f'{glob.escape(path)}.*.gz'):
+        number = name[len(path) + 1:-len('.gz')]
+        if number.isdigit():
+            rotated.append((int(number), name))
+    files = [name for _, name in sorted(rotated, reverse=True)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+def read_lines(paths):
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+            yield from f
+
+class LogStats:
+
+    def __init__(self):
+        self.outcomes = {'success': 0, 'failed': 0, 'skipped': 0, 'coalesced': 0, 'unfinished': 0}
+        self.failures = {}  # failure class -> failed runs
+        self.errors = {}  # failure class -> matching lines in any run
+        self.days = {}  # date -> {'runs', 'failed', 'commits'}
+        self.first_date = None
+        self.last_date = None
+        self._date = None
+        self._run = None  # {'date', 'failure'} of the run being read
+
+    def _day(self, date):
+        return self.days.setdefault(date, {'runs': 0, 'failed': 0, 'commits': 0})
+
+    def _finish(self, outcome):
+        run = self._run
+        self._run = None
+        self.outcomes[outcome] += 1
+        if outcome == 'failed':
+            failure = run['failure'] or 'other'
+            self.failures[failure] = self.failures.get(failure, 0) + 1
+            self._day(run['date'])['failed'] += 1
+
+    def _standalone(self, outcome):
+        self.outcomes[outcome] += 1
+        self._day(self._date)['runs'] += 1
+        if outcome == 'failed':
+            self.failures['merged'] = self.failures.get('merged', 0) + 1
+            self._day(self._date)['failed'] += 1
+
+    def _note_problem(self, text):
+        failure = classify(text)
+        if failure:
+            self.errors[failure] = self.errors.get(failure, 0) + 1
+            if self._run is not None and self._run['failure'] is None:
+                self._run['failure'] = failure
+
+    def feed(self, line):
+        match = LINE_RE.match(line)
+        if not match:
+            # Raw git output or a traceback line
+            if line.strip():
+                self._note_problem(line)
+            return
+        date, level, message = match.groups()
+        self._date = date
+        self.first_date = self.first_date or date
+        self.last_date = date
+
+        if message.startswith(START_MARKER):
+            if self._run is not None:
+                self._finish('unfinished')
+            self._run = {'date': date, 'failure': None}
+            self._day(date)['runs'] += 1
+            return
+        # A lock timeout belongs to the skipped run, not to the one holding the lock
+        if message.startswith(SKIPPED_MARKERS):
+            self._standalone('skipped')
+            return
+        if level in ('WARNING', 'ERROR', 'CRITICAL'):
+            self._note_problem(message)
+        if message.startswith(COMMIT_MARKERS):
+            self._day(date)['commits'] += 1
+        elif message.startswith(COALESCED_MARKERS):
+            self._standalone('coalesced')
+        elif message.startswith(MERGED_FAILURE_MARKERS):
+            self._standalone('failed')
+        elif self._run is not None:
+            if message.startswith(SUCCESS_MARKERS):
+                self._finish('success')
+            elif message.startswith(FAILURE_MARKERS):
+                self._finish('failed')
+
+    def close(self):
+        if self._run is not None:
+            self._finish('unfinished')
+
+    def report(self):
+        runs = sum(self.outcomes.values())
+        # Unfinished runs are left out: old runs stop logging when the pull
+        # replaced the tracked log file, so their outcome is unknown
+        known = runs - self.outcomes['unfinished']
+        return {
+            'first_date': self.first_date,
+            'last_date': self.last_date,
+            'runs': runs,
+            'outcomes': self.outcomes,
+            # Coalesced runs had their commit made by another run
+            'success_rate': (self.outcomes['success'] + self.outcomes['coalesced']) / known if known else None,
+            'failures_by_class': self.failures,
+            'error_lines_by_class': self.errors,
+            'days': self.days,
+        }
+
+def collect(path):
+    stats = LogStats()
+    for line in read_lines(log_files(path)):
+        stats.feed(line)
+    stats.close()
+    return stats.report()
+
+def print_report(report):
+    if not report['runs'] and not report['days']:
+        print("No runs found.")
+        return
+    print(f"Runs {report['first_date']} to {report['last_date']}: {report['runs']}")
+    for outcome, count in report['outcomes'].items():
+        print(f"  {outcome:<12} {count:>6}")
+    unfinished = report['outcomes']['unfinished']
+    if report['success_rate'] is not None:
+        print(f"Success rate: {report['success_rate']:.1%}"
+              + (f" (of {report['runs'] - unfinished} finished runs)" if unfinished else ''))
+    elif unfinished:
+        print("Success rate: unknown (no run logged how it ended)")
+    print("Failed runs by class:")
+    for failure, count in sorted(report['failures_by_class'].items(), key=lambda item: -item[1]):
+        print(f"  {failure:<16} {count:>6}")
+    print("Error lines by class (all runs, including git output):")
+    for failure, count in sorted(report['error_lines_by_class'].items(), key=lambda item: -item[1]):
+        print(f"  {failure:<16} {count:>6}")
+    print(f"{'date':<12} {'runs':>6} {'failed':>6} {'commits':>8}")
+    for date, day in sorted(report['days'].items()):
+        print(f"{date:<12} {day['runs']:>6} {day['failed']:>6} {day['commits']:>8}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize run outcomes and failures from commit_output.log.")
+    parser.add_argument('--log', default='commit_output.log', help="log file; its rotated .gz files are read too")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+    report = collect(args.log)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
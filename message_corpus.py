@@ -0,0 +1,213 @@
+import array
+import logging
+import math
+import mmap
+import os
+import random
+import struct
+
+# A message corpus with one message per line, read through a sidecar index
+# of line offsets (<corpus>.idx). The index header records the corpus mtime
+# and size it was built from, and the index is rebuilt whenever they no
+# longer match. Picking a message is one lookup in the memory-mapped index
+# and one slice of the memory-mapped corpus, however large the corpus is.
+#
+# A line may end in a tab and a weight ("Fixed it again\t3"); lines without
+# one weigh 1 and lines weighing 0 are left out.
+#
+# Index layout: header (magic, mtime_ns, size, count, max_weight), then
+# count pairs of native unsigned 64-bit start/end offsets, then count native
+# doubles holding the weights. Blank lines are not indexed and offsets
+# exclude surrounding whitespace and the weight.
+
+INDEX_MAGIC = b'GUMSGIX2'
+INDEX_HEADER = struct.Struct('=8sQQQd')
+
+def parse_line(line):
+    # Returns (offset of the message within line, its length, weight)
+    stripped = line.strip()
+    start = len(line) - len(line.lstrip())
+    text, tab, tail = stripped.rpartition(b'\t')
+    if tab:
+        try:
+            weight = float(tail)
+        except ValueError:
+            weight = None
+        if weight is not None and math.isfinite(weight):
+            return start, len(text.rstrip()), weight
+    return start, len(stripped), 1.0
+
+class MessageCorpus:
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or f'{path}.idx'
+        self.key = None
+        self.max_weight = 1.0
+        self._corpus = None
+        self._index = None
+        self._offsets = None
+        self._weights = None
+
+    def close(self):
+        for view in (self._offsets, self._weights):
+            if view is not None:
+                view.release()
+        for mapping in (self._corpus, self._index):
+            if mapping is not None:
+                mapping.close()
+        self.key = self._corpus = self._index = self._offsets = self._weights = None
+
+    def build_index(self, key):
+        offsets = array.array('Q')
+        weights = array.array('d')
+        with open(self.path, 'rb') as f:
+            pos = 0
+            for line in f:
+                start, length, weight = parse_line(line)
+                if length and weight > 0:
+                    offsets.append(pos + start)
+                    offsets.append(pos + start + length)
+                    weights.append(weight)
+                pos += len(line)
+        # Several processes may rebuild at once; each renames a complete file
+        tmp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, key[0], key[1], len(weights), max(weights, default=1.0)))
+            offsets.tofile(f)
+            weights.tofile(f)
+        os.replace(tmp_path, self.index_path)
+        logging.info(f"Indexed {len(weights)} messages in {self.path}")
+
+    def _read_header(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+                index_size = os.fstat(f.fileno()).st_size
+        except FileNotFoundError:
+            return None
+        if len(header) != INDEX_HEADER.size:
+            return None
+        magic, mtime_ns, size, count, max_weight = INDEX_HEADER.unpack(header)
+        # A foreign, older or truncated file is rebuilt like a stale one
+        if magic != INDEX_MAGIC or index_size != INDEX_HEADER.size + 24 * count:
+            return None
+        return (mtime_ns, size, count, max_weight)
+
+    def refresh(self):
+        # One stat per call; reopen (and reindex if needed) when the corpus changed
+        stat = os.stat(self.path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        if self.key is not None and key == self.key[:2]:
+            return
+        self.close()
+        header = self._read_header()
+        if header is None or header[:2] != key:
+            self.build_index(key)
+            header = self._read_header()
+        count = header[2]
+
+        with open(self.index_path, 'rb') as f:
+            self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._index)
+        self._offsets = view[INDEX_HEADER.size:INDEX_HEADER.size + 16 * count].cast('Q')
+        self._weights = view[INDEX_HEADER.size + 16 * count:].cast('d')
+        view.release()
+        if key[1]:
+            with open(self.path, 'rb') as f:
+                self._corpus = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.max_weight = header[3]
+        self.key = key + (count,)
+
+    def _message(self, number):
+        start = self._offsets[2 * number]
+        end = self._offsets[2 * number + 1]
+        return self._corpus[start:end].decode('utf-8', errors='replace')
+
+    def __len__(self):
+        self.refresh()
+        return len(self._weights)
+
+    def message(self, number):
+        self.refresh()
+        return self._message(number)
+
+    def weights(self):
+        self.refresh()
+        return self._weights
+
+    def random_message(self, rng=random):
+        self.refresh()
+        count = len(self._weights)
+        if not count:
+            raise ValueError(f"No commit messages in {self.path}")
+        # Rejection sampling keeps the weighted pick O(1) on average
+        while True:
+            number = rng.randrange(count)
+            if rng.random() * self.max_weight < self._weights[number]:
+                return self._message(number)
+
+# The order in which a ShuffleBag hands out messages, with a cursor, kept in
+# a binary state file: header (magic, corpus mtime_ns, size, count, cursor),
+# then count native unsigned 32-bit message numbers. Every message is used
+# once before any repeats. With weights, the order is a weighted random
+# permutation (Efraimidis-Spirakis), so heavier messages tend to come
+# earlier in each bag. A new bag is drawn when the current one is used up or
+# the corpus changes.
+
+BAG_MAGIC = b'GUMSGBG1'
+BAG_HEADER = struct.Struct('=8sQQQQ')
+
+class ShuffleBag:
+
+    def __init__(self, corpus, path):
+        self.corpus = corpus
+        self.path = path
+
+    def _read_header(self, f):
+        header = f.read(BAG_HEADER.size)
+        if len(header) != BAG_HEADER.size:
+            return None
+        magic, mtime_ns, size, count, cursor = BAG_HEADER.unpack(header)
+        if magic != BAG_MAGIC or os.fstat(f.fileno()).st_size != BAG_HEADER.size + 4 * count:
+            return None
+        return (mtime_ns, size, count), cursor
+
+    def new_bag(self, rng=random):
+        key = self.corpus.key
+        weights = self.corpus.weights()
+        order = array.array('I', range(key[2]))
+        if any(weight != 1.0 for weight in weights):
+            # Each message's sort key is log(u) / weight, u uniform in (0, 1]
+            order = array.array('I', sorted(order, key=lambda number: math.log(1.0 - rng.random()) / weights[number],
+                                            reverse=True))
+        else:
+            rng.shuffle(order)
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(BAG_HEADER.pack(BAG_MAGIC, key[0], key[1], key[2], 0))
+            order.tofile(f)
+        os.replace(tmp_path, self.path)
+        logging.info(f"Started a new bag of {key[2]} commit messages")
+
+    def next_message(self, rng=random):
+        # Reads one entry and rewrites the cursor in place. Callers hold the
+        # run lock, so picks never interleave.
+        self.corpus.refresh()
+        if not self.corpus.key[2]:
+            raise ValueError(f"No commit messages in {self.corpus.path}")
+        for _ in range(2):
+            try:
+                with open(self.path, 'r+b') as f:
+                    state = self._read_header(f)
+                    if state and state[0] == self.corpus.key and state[1] < state[0][2]:
+                        cursor = state[1]
+                        number = array.array('I', os.pread(f.fileno(), 4, BAG_HEADER.size + 4 * cursor))[0]
+                        os.pwrite(f.fileno(), struct.pack('=Q', cursor + 1), BAG_HEADER.size - 8)
+                        return self.corpus.message(number)
+            except FileNotFoundError:
+                pass
+            self.new_bag(rng)
+        raise Exception(f"Cannot read message bag {self.path}")
@@ -0,0 +1,158 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import log_setup
+
+class RunMetrics:
+    # Timings for the current run. Phases nest, so a phase started inside
+    # 'pull' is recorded as 'pull/<name>'; every git subprocess is recorded
+    # with its duration and exit code. start_run() clears the previous run.
+
+    def __init__(self):
+        self.run_started = None
+        self.run_id = None
+        self._phase_stack = []
+        self._phases = []
+        self._commands = []
+        self._retries = {}
+        self._appended = {}
+        self._errors = []
+
+    def start_run(self, run_id=None):
+        self.run_started = time.time()
+        self.run_id = run_id
+        self._phase_stack.clear()
+        self._phases.clear()
+        self._commands.clear()
+        self._retries.clear()
+        self._appended.clear()
+        self._errors.clear()
+
+    @contextmanager
+    def phase(self, name):
+        self._phase_stack.append(name)
+        path = '/'.join(self._phase_stack)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._phase_stack.pop()
+            self._phases.append({'phase': path, 'seconds': time.monotonic() - start})
+
+    def record_phase(self, name, seconds):
+        # For work timed outside the phase stack, e.g. on another thread
+        self._phases.append({'phase': name, 'seconds': seconds})
+
+    def record_command(self, args, seconds, exit_code):
+        self._commands.append({'command': command_name(args), 'seconds': seconds, 'exit_code': exit_code,
+                               'phase': '/'.join(self._phase_stack)})
+
+    def count_retry(self, operation):
+        self._retries[operation] = self._retries.get(operation, 0) + 1
+
+    def count_appended(self, path, size):
+        self._appended[path] = self._appended.get(path, 0) + size
+
+    def record_error(self, operation, error):
+        # Keeps git's output with the error so it can be classified later
+        text = str(error)
+        for output in (getattr(error, 'stdout', None), getattr(error, 'stderr', None)):
+            if isinstance(output, bytes):
+                output = output.decode(errors='replace')
+            if output and output.strip():
+                text += '\n' + output.strip()
+        self._errors.append({'operation': operation, 'error': text})
+
+    def summarize(self, outcome):
+        finished = time.time()
+        return {
+            'timestamp': finished,
+            'run_id': self.run_id,
+            'started': self.run_started,
+            'outcome': outcome,
+            'seconds': finished - self.run_started if self.run_started else 0.0,
+            'phases': list(self._phases),
+            'commands': list(self._commands),
+            'retries': dict(self._retries),
+            'appended': dict(self._appended),
+            'errors': list(self._errors),
+        }
+
+def command_name(args):
+    if os.path.basename(args[0]) == 'git' and len(args) > 1:
+        return args[1]
+    return os.path.basename(args[0])
+
+def _labels(**labels):
+    return ','.join(f'{key}="{"" if value is None else value}"' for key, value in labels.items())
+
+def format_prometheus(summary, prefix='github_updater'):
+    phase_seconds = {}
+    phase_calls = {}
+    for entry in summary['phases']:
+        phase_seconds[entry['phase']] = phase_seconds.get(entry['phase'], 0.0) + entry['seconds']
+        phase_calls[entry['phase']] = phase_calls.get(entry['phase'], 0) + 1
+    command_seconds = {}
+    command_calls = {}
+    for entry in summary['commands']:
+        command_seconds[entry['command']] = command_seconds.get(entry['command'], 0.0) + entry['seconds']
+        key = (entry['command'], entry['exit_code'])
+        command_calls[key] = command_calls.get(key, 0) + 1
+
+    lines = [
+        f'# HELP {prefix}_last_run_timestamp_seconds When the last run finished.',
+        f'# TYPE {prefix}_last_run_timestamp_seconds gauge',
+        f"{prefix}_last_run_timestamp_seconds {summary['timestamp']:.3f}",
+        f'# HELP {prefix}_last_run_success 1 if the last run completed, 0 if it failed or was skipped.',
+        f'# TYPE {prefix}_last_run_success gauge',
+        f"{prefix}_last_run_success {int(summary['outcome'] == 'success')}",
+        f'# HELP {prefix}_run_duration_seconds Wall time of the last run.',
+        f'# TYPE {prefix}_run_duration_seconds gauge',
+        f"{prefix}_run_duration_seconds {summary['seconds']:.6f}",
+        f'# HELP {prefix}_phase_duration_seconds Time spent in each phase of the last run.',
+        f'# TYPE {prefix}_phase_duration_seconds gauge',
+    ]
+    lines += [f'{prefix}_phase_duration_seconds{{{_labels(phase=name)}}} {seconds:.6f}'
+              for name, seconds in sorted(phase_seconds.items())]
+    lines += [
+        f'# HELP {prefix}_phase_calls Times each phase ran in the last run.',
+        f'# TYPE {prefix}_phase_calls gauge',
+    ]
+    lines += [f'{prefix}_phase_calls{{{_labels(phase=name)}}} {calls}'
+              for name, calls in sorted(phase_calls.items())]
+    lines += [
+        f'# HELP {prefix}_git_command_duration_seconds Time spent in each git subcommand in the last run.',
+        f'# TYPE {prefix}_git_command_duration_seconds gauge',
+    ]
+    lines += [f'{prefix}_git_command_duration_seconds{{{_labels(command=name)}}} {seconds:.6f}'
+              for name, seconds in sorted(command_seconds.items())]
+    lines += [
+        f'# HELP {prefix}_git_commands Git subprocesses run in the last run, by exit code.',
+        f'# TYPE {prefix}_git_commands gauge',
+    ]
+    lines += [f'{prefix}_git_commands{{{_labels(command=name, exit_code=code)}}} {calls}'
+              for (name, code), calls in sorted(command_calls.items(), key=str)]
+    lines += [
+        f'# HELP {prefix}_retries Retries made in the last run.',
+        f'# TYPE {prefix}_retries gauge',
+    ]
+    lines += [f'{prefix}_retries{{{_labels(operation=name)}}} {count}'
+              for name, count in sorted(summary['retries'].items())]
+    return '\n'.join(lines) + '\n'
+
+def write_textfile(path, summary):
+    # Written to a temporary file and renamed, as the node_exporter textfile
+    # collector may read the file at any moment
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(format_prometheus(summary))
+    os.replace(tmp_path, path)
+
+def append_jsonl(path, summary, max_bytes=0, backup_count=7):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    log_setup.rotate_file(path, max_bytes, backup_count)
+    with open(path, 'a') as f:
+        f.write(json.dumps(summary) + '\n')
@@ -0,0 +1,147 @@
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import log_setup
+from updater import Updater
+
+# Runs the commit pipeline on many repositories from one process, instead of
+# a checkout, cron entry and set of at jobs per repository.
+
+MAX_WORKERS = 4  # repositories worked on at once
+LOG_FILE = 'multi_repo.log'
+LOG_LEVEL = os.environ.get('GITHUB_UPDATER_LOG_LEVEL', 'INFO')
+
+_stop_requested = threading.Event()
+
+def request_stop(signum, frame):
+    logging.info(f"Received signal {signum}, stopping after the running cycles.")
+    _stop_requested.set()
+
+def read_repo_list(path):
+    # One repository path per line; blank lines, comments and duplicates are skipped
+    repos = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            repo = os.path.realpath(os.path.expanduser(line))
+            if repo not in repos:
+                repos.append(repo)
+    return repos
+
+def is_work_tree(path):
+    # True only for the top of a git work tree; the session would otherwise
+    # create its state files in whatever directory it was given
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--show-toplevel'], cwd=path, check=True,
+                                capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return False
+    return os.path.realpath(result.stdout.strip()) == os.path.realpath(path)
+
+class MultiRepoDriver:
+    # Each repository gets its own Updater session, kept for the life of the
+    # driver, and its own lock, so it is never worked on by two workers at
+    # once; the run lock inside run_commit_cycle still keeps it apart from
+    # at jobs or a daemon on the same repository. A repository that fails or
+    # hangs on a slow remote ties up one worker and nothing else: its error
+    # is logged, and later passes skip it until it is done. Paths that are
+    # not the top of a git work tree are rejected up front, in `rejected`.
+
+    def __init__(self, repos, max_workers=MAX_WORKERS, **settings):
+        self.repos = []
+        self.rejected = []
+        for repo in repos:
+            if is_work_tree(repo):
+                self.repos.append(repo)
+            else:
+                logging.error(f"{repo} is not a git work tree; skipping it")
+                self.rejected.append(repo)
+        self.settings = settings
+        self.sessions = {}
+        self.locks = {repo: threading.Lock() for repo in self.repos}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='repo')
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def run_repo(self, repo):
+        # Log lines carry the repository name through the thread name
+        thread = threading.current_thread()
+        thread_name = thread.name
+        thread.name = os.path.basename(repo)
+        try:
+            session = self.sessions.get(repo)
+            if session is None:
+                session = self.sessions[repo] = Updater(repo, **self.settings)
+            return session.run_commit_cycle()
+        except Exception as e:
+            logging.error(f"Commit cycle for {repo} failed: {e}", exc_info=True)
+            return False
+        finally:
+            thread.name = thread_name
+            self.locks[repo].release()
+
+    def submit_pass(self):
+        # Start a cycle on every repository that is not still busy with the last one
+        futures = {}
+        for repo in self.repos:
+            if not self.locks[repo].acquire(blocking=False):
+                logging.warning(f"{repo} is still busy; skipping it this pass")
+                continue
+            futures[repo] = self.executor.submit(self.run_repo, repo)
+        return futures
+
+    def run_once(self):
+        results = {repo: future.result() for repo, future in self.submit_pass().items()}
+        failed = [repo for repo, ok in results.items() if not ok]
+        logging.info(f"Pass finished: {len(results) - len(failed)} of {len(results)} repositories succeeded")
+        for repo in failed:
+            logging.warning(f"Commit cycle failed for {repo}")
+        return results
+
+    def run_forever(self, interval):
+        # Passes start every `interval` seconds whether or not the last one has finished
+        while not _stop_requested.is_set():
+            self.submit_pass()
+            _stop_requested.wait(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the commit pipeline on many repositories at once.")
+    parser.add_argument('repo_list', help="file with one repository path per line")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help="repositories worked on at once")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="seconds between passes; 0 (default) makes one pass and exits")
+    parser.add_argument('--log', default=LOG_FILE, help="log file shared by all repositories")
+    args = parser.parse_args()
+
+    log_setup.setup_logging(args.log, LOG_LEVEL, log_format=log_setup.THREAD_LOG_FORMAT)
+    repos = read_repo_list(args.repo_list)
+    logging.info(f"Working on {len(repos)} repositories with {args.workers} worker(s)")
+    with MultiRepoDriver(repos, max_workers=args.workers) as driver:
+        for repo in driver.rejected:
+            print(f"{'SKIP':<6} {repo} (not a git work tree)")
+        if args.interval:
+            signal.signal(signal.SIGTERM, request_stop)
+            signal.signal(signal.SIGINT, request_stop)
+            driver.run_forever(args.interval)
+        else:
+            results = driver.run_once()
+            for repo, ok in results.items():
+                print(f"{'ok' if ok else 'FAILED':<6} {repo}")
+            raise SystemExit(0 if all(results.values()) and not driver.rejected else 1)
@@ -0,0 +1,35 @@
+import os
+import string
+
+# Random text in bulk: os.urandom bytes are mapped onto the alphabet with one
+# bytes.translate call instead of drawing characters one at a time. Bytes of
+# 190 and above are deleted first so every character stays equally likely
+# (190 = 2 * 95), which costs about a quarter of the random bytes.
+
+ALPHABET = (string.ascii_letters + string.digits + string.punctuation + ' ').encode()
+_TABLE = bytes(ALPHABET[i % len(ALPHABET)] for i in range(256))
+_REJECT = bytes(range(256 - 256 % len(ALPHABET), 256))
+CHUNK_SIZE = 1024 * 1024
+
+def random_bytes(length):
+    out = bytearray()
+    while len(out) < length:
+        missing = length - len(out)
+        # Ask for enough that one round is almost always sufficient
+        out += os.urandom(missing * 256 // (256 - len(_REJECT)) + 64).translate(_TABLE, _REJECT)
+    del out[length:]
+    return bytes(out)
+
+def random_text(length):
+    return random_bytes(length).decode('ascii')
+
+def iter_random_bytes(length, chunk_size=CHUNK_SIZE):
+    # Memory stays at one chunk however long the payload is
+    while length > 0:
+        chunk = random_bytes(min(chunk_size, length))
+        length -= len(chunk)
+        yield chunk
+
+def write_random_bytes(f, length, chunk_size=CHUNK_SIZE):
+    for chunk in iter_random_bytes(length, chunk_size):
+        f.write(chunk)
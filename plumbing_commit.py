@@ -0,0 +1,146 @@
+import logging
+import subprocess
+import time
+
+from git_runner import PipeProcess
+
+class PlumbingCommitter:
+    # Commits files without 'git add' / 'git commit': blobs are written by a
+    # long-lived 'git hash-object', trees are read through a long-lived
+    # 'git cat-file --batch', and only the trees on the path to a changed
+    # file are rebuilt with 'git mktree'. The branch is moved with a
+    # compare-and-swap 'git update-ref', so the cost of a commit depends on
+    # the number of changed files, not on the size of the working tree.
+
+    def __init__(self, runner, cwd=None, timeout=None):
+        # One-shot commands go through runner (a git_runner.GitRunner), which
+        # also records the requests served by the long-lived processes
+        self.runner = runner
+        self.cwd = cwd
+        self.timeout = timeout
+        self._hasher = None
+        self._reader = None
+
+    def _start(self, args):
+        # In its own process group, like the one-shot commands
+        return PipeProcess(args, cwd=self.cwd)
+
+    def close(self):
+        for proc in (self._hasher, self._reader):
+            if proc:
+                proc.close(timeout=self.timeout)
+        self._hasher = None
+        self._reader = None
+
+    def _start_request(self, proc):
+        # A request gets the command timeout, capped by the run's deadline;
+        # if it runs out the process is killed and started again next time
+        proc.start_request(self.runner.timeout_for(self.timeout))
+        return time.monotonic()
+
+    def hash_paths(self, paths):
+        if self._hasher is None or not self._hasher.alive():
+            self._hasher = self._start(['git', 'hash-object', '-w', '--stdin-paths'])
+        start = self._start_request(self._hasher)
+        blobs = {}
+        try:
+            for path in paths:
+                self._hasher.write(path.encode() + b'\n')
+                line = self._hasher.readline()
+                if not line:
+                    raise Exception(f"git hash-object exited while hashing {path}: {self._hasher.error_output()}")
+                blobs[path] = line.decode().strip()
+        except subprocess.TimeoutExpired:
+            self.runner.record_command(self._hasher.args, time.monotonic() - start, 'timeout')
+            raise
+        # Served by a running process, so there is no exit code to record
+        self.runner.record_command(self._hasher.args, time.monotonic() - start, None)
+        return blobs
+
+    def read_tree(self, tree_ish):
+        if self._reader is None or not self._reader.alive():
+            self._reader = self._start(['git', 'cat-file', '--batch'])
+        start = self._start_request(self._reader)
+        try:
+            self._reader.write(tree_ish.encode() + b'\n')
+            header = self._reader.readline().decode().split()
+            if len(header) != 3 or header[1] != 'tree':
+                raise Exception(f"Cannot read tree {tree_ish}: {' '.join(header)}")
+            oid_len = len(header[0]) // 2
+            data = self._reader.read(int(header[2]))
+            self._reader.read(1)  # trailing newline
+        except subprocess.TimeoutExpired:
+            self.runner.record_command(self._reader.args, time.monotonic() - start, 'timeout')
+            raise
+        self.runner.record_command(self._reader.args, time.monotonic() - start, None)
+
+        entries = {}
+        pos = 0
+        while pos < len(data):
+            space = data.index(b' ', pos)
+            nul = data.index(b'\0', space)
+            mode = data[pos:space].decode().zfill(6)
+            name = data[space + 1:nul].decode()
+            entries[name] = (mode, data[nul + 1:nul + 1 + oid_len].hex())
+            pos = nul + 1 + oid_len
+        return entries
+
+    def _object_type(self, mode):
+        if mode == '040000':
+            return 'tree'
+        if mode == '160000':
+            return 'commit'
+        return 'blob'
+
+    def write_tree(self, base_tree, changes, modes, prefix=''):
+        # changes maps paths relative to this tree to new blob ids; the file
+        # mode used for each changed path is recorded in modes
+        entries = self.read_tree(base_tree) if base_tree else {}
+        subdirs = {}
+        for path, blob in changes.items():
+            name, _, rest = path.partition('/')
+            if rest:
+                subdirs.setdefault(name, {})[rest] = blob
+            else:
+                mode = entries[name][0] if name in entries else '100644'
+                entries[name] = (mode, blob)
+                modes[prefix + name] = mode
+        for name, sub_changes in subdirs.items():
+            sub_base = entries[name][1] if name in entries else None
+            entries[name] = ('040000', self.write_tree(sub_base, sub_changes, modes,
+                                                       f'{prefix}{name}/'))
+
+        listing = b''.join(
+            f"{mode} {self._object_type(mode)} {oid}\t{name}".encode() + b'\0'
+            for name, (mode, oid) in entries.items()
+        )
+        result = self.runner.run(['git', 'mktree', '-z'], input=listing, check=True,
+                                 capture_output=True, timeout=self.timeout, cwd=self.cwd)
+        return result.stdout.decode().strip()
+
+    def commit(self, file_paths, commit_message, parent):
+        paths = [path.replace('\\', '/') for path in file_paths]
+        blobs = self.hash_paths(paths)
+        modes = {}
+        tree = self.write_tree(f'{parent}^{{tree}}' if parent else None, blobs, modes)
+
+        commit_args = ['git', 'commit-tree', tree, '-F', '-']
+        if parent:
+            commit_args[3:3] = ['-p', parent]
+        result = self.runner.run(commit_args, input=commit_message.rstrip('\n').encode() + b'\n', check=True,
+                                 capture_output=True, timeout=self.timeout, cwd=self.cwd)
+        commit = result.stdout.decode().strip()
+
+        # Only move HEAD if nobody else moved it since `parent` was read
+        self.runner.run(['git', 'update-ref', '-m', f'commit: {commit_message}',
+                         'HEAD', commit, parent or ''],
+                        check=True, capture_output=True, timeout=self.timeout, cwd=self.cwd)
+
+        # Point the index entries at the new blobs so the working tree shows
+        # as clean, without re-reading the files
+        index_info = b''.join(f"{modes[path]} {blobs[path]}\t{path}".encode() + b'\0' for path in paths)
+        self.runner.run(['git', 'update-index', '-z', '--index-info'], input=index_info,
+                        check=True, capture_output=True, timeout=self.timeout, cwd=self.cwd)
+
+        logging.info(f"Created commit {commit} with {len(paths)} file(s) via git plumbing.")
+        return commit
@@ -0,0 +1,57 @@
+import json
+import os
+import time
+
+# Results of preflight checks, kept on disk so repeated runs and retries can
+# skip the subprocesses behind them. Each entry is valid until its TTL runs
+# out or its invalidation key (e.g. config file mtimes) changes.
+
+def load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_cache(path, cache):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+def file_mtimes(paths):
+    key = []
+    for path in paths:
+        try:
+            key.append(os.stat(os.path.expanduser(path)).st_mtime_ns)
+        except FileNotFoundError:
+            key.append(None)
+    return key
+
+def lookup(path, name, key):
+    # The cached value, or None when there is none that is still valid
+    entry = load_cache(path).get(name)
+    if entry and entry['key'] == key and entry['expires'] > time.time():
+        return entry['value']
+    return None
+
+def store(path, name, ttl, key, value):
+    # Only successful results are cached; a failed check is retried next time
+    if value:
+        cache = load_cache(path)
+        cache[name] = {'value': value, 'key': key, 'expires': time.time() + ttl}
+        save_cache(path, cache)
+    return value
+
+async def cached_check_async(path, name, ttl, key, compute):
+    # The cached value, or else the result of awaiting compute(), cached if it is truthy
+    value = lookup(path, name, key)
+    if value is not None:
+        return value
+    return store(path, name, ttl, key, await compute())
+
+def invalidate(path, name):
+    cache = load_cache(path)
+    if cache.pop(name, None) is not None:
+        save_cache(path, cache)
@@ -0,0 +1,42 @@
+import json
+import os
+import time
+
+# The commits themselves are already safe in the local repository; the queue
+# file only remembers how many are waiting to be pushed and since when, so
+# the push policy survives restarts and offline periods.
+
+def load_queue(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'pending': 0, 'since': None}
+
+def save_queue(path, queue):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(queue, f)
+    os.replace(tmp_path, path)
+
+def enqueue_commits(path, count, now=None):
+    queue = load_queue(path)
+    if not queue['pending']:
+        queue['since'] = now if now is not None else time.time()
+    queue['pending'] += count
+    save_queue(path, queue)
+    return queue
+
+def clear_queue(path):
+    save_queue(path, {'pending': 0, 'since': None})
+
+def push_due(queue, policy, every_commits, every_seconds, now=None):
+    if not queue['pending']:
+        return False
+    if policy == 'count':
+        return queue['pending'] >= every_commits
+    if policy == 'interval':
+        now = now if now is not None else time.time()
+        return now - queue['since'] >= every_seconds
+    return True  # 'immediate'
@@ -0,0 +1,68 @@
+import subprocess
+from dataclasses import dataclass, field
+
+@dataclass
+class RepoState:
+    is_repo: bool = False
+    head: str = None          # commit id of HEAD, None before the first commit
+    branch: str = None        # None when HEAD is detached
+    upstream: str = None      # e.g. 'origin/main', None when no upstream is set
+    ahead: int = 0
+    behind: int = 0
+    changed: list = field(default_factory=list)    # staged or unstaged tracked changes
+    unmerged: list = field(default_factory=list)
+    untracked: list = field(default_factory=list)
+
+    @property
+    def dirty(self):
+        return bool(self.changed or self.unmerged or self.untracked)
+
+    def mark_committed(self, head):
+        # Everything in the working tree was just committed on top of HEAD
+        self.head = head
+        self.changed = []
+        self.untracked = []
+        if self.upstream:
+            self.ahead += 1
+
+def parse_porcelain_v2(output):
+    state = RepoState(is_repo=True)
+    entries = output.split('\0')
+    i = 0
+    while i < len(entries):
+        entry = entries[i]
+        i += 1
+        if not entry:
+            continue
+        if entry.startswith('# '):
+            key, _, value = entry[2:].partition(' ')
+            if key == 'branch.oid':
+                state.head = None if value == '(initial)' else value
+            elif key == 'branch.head':
+                state.branch = None if value == '(detached)' else value
+            elif key == 'branch.upstream':
+                state.upstream = value
+            elif key == 'branch.ab':
+                ahead, behind = value.split()
+                state.ahead = int(ahead)
+                state.behind = -int(behind)
+        elif entry[0] == '1':
+            state.changed.append(entry.split(' ', 8)[8])
+        elif entry[0] == '2':
+            state.changed.append(entry.split(' ', 9)[9])
+            i += 1  # skip the original path of a rename or copy
+        elif entry[0] == 'u':
+            state.unmerged.append(entry.split(' ', 10)[10])
+        elif entry[0] == '?':
+            state.untracked.append(entry[2:])
+    return state
+
+def probe_repo_state(run=subprocess.run, cwd=None, timeout=None):
+    # One git process describes the branch, its upstream and every changed path;
+    # run is subprocess.run or a drop-in such as git_runner.GitRunner.run
+    try:
+        result = run(['git', 'status', '--porcelain=v2', '--branch', '-z'],
+                     check=True, capture_output=True, text=True, cwd=cwd, timeout=timeout)
+    except subprocess.CalledProcessError:
+        return RepoState(is_repo=False)
+    return parse_porcelain_v2(result.stdout)
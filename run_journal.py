@@ -0,0 +1,157 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import time
+
+from log_stats import classify
+
+# One row per run in a local SQLite database, written when the run finishes.
+# The database is in WAL mode, so a run writing its row does not block
+# status queries or other runs. The status queries are answered from the
+# indexes below without scanning the table or parsing logs.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started REAL,
+    finished REAL NOT NULL,
+    outcome TEXT NOT NULL,
+    commits INTEGER NOT NULL DEFAULT 0,
+    git_commands INTEGER NOT NULL DEFAULT 0,
+    phases TEXT,            -- JSON object, phase -> seconds
+    files TEXT,             -- JSON array of the files appended to
+    bytes_appended INTEGER NOT NULL DEFAULT 0,
+    commit_sha TEXT,
+    push_result TEXT,       -- 'pushed', 'failed', 'queued' or NULL when there was nothing to push
+    push_seconds REAL,
+    error_class TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_outcome_finished ON runs (outcome, finished);
+CREATE INDEX IF NOT EXISTS runs_push_finished ON runs (push_result, finished, push_seconds);
+"""
+
+BUSY_TIMEOUT = 30  # seconds to wait for another run's write
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+def push_result(summary, commits):
+    # The last git push of the run decides; without one, new commits are queued
+    pushes = [command for command in summary['commands'] if command['command'] == 'push']
+    if pushes:
+        return ('pushed' if pushes[-1]['exit_code'] == 0 else 'failed'), pushes[-1]['seconds']
+    return ('queued' if commits else None), None
+
+def run_row(summary, commits=0, commit_sha=None):
+    phases = {}
+    for entry in summary['phases']:
+        phases[entry['phase']] = phases.get(entry['phase'], 0.0) + entry['seconds']
+    result, push_seconds = push_result(summary, commits)
+    error = summary['errors'][-1]['error'] if summary['errors'] else None
+    return {
+        'run_id': summary['run_id'],
+        'started': summary['started'],
+        'finished': summary['timestamp'],
+        'outcome': summary['outcome'],
+        'commits': commits,
+        'git_commands': len(summary['commands']),
+        'phases': json.dumps(phases),
+        'files': json.dumps(sorted(summary['appended'])),
+        'bytes_appended': sum(summary['appended'].values()),
+        'commit_sha': commit_sha,
+        'push_result': result,
+        'push_seconds': push_seconds,
+        'error_class': (classify(error) or 'other') if error else None,
+        'error': error,
+    }
+
+def record_run(path, summary, commits=0, commit_sha=None):
+    row = run_row(summary, commits, commit_sha)
+    try:
+        conn = connect(path)
+        try:
+            with conn:
+                conn.execute(f"INSERT OR REPLACE INTO runs ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                             list(row.values()))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logging.warning(f"Could not write run {row['run_id']} to {path}: {e}")
+    return row
+
+def status(path, window=86400, now=None):
+    now = now or time.time()
+    since = now - window
+    conn = connect(path)
+    try:
+        last_push = conn.execute("SELECT run_id, finished, push_seconds FROM runs WHERE push_result = 'pushed' "
+                                 "ORDER BY finished DESC LIMIT 1").fetchone()
+        failures = dict(conn.execute("SELECT COALESCE(error_class, 'other'), COUNT(*) FROM runs "
+                                     "WHERE outcome = 'failed' AND finished >= ? GROUP BY 1", (since,)))
+        failed_pushes = conn.execute("SELECT COUNT(*) FROM runs WHERE push_result = 'failed' AND finished >= ?",
+                                     (since,)).fetchone()[0]
+        average, pushes = conn.execute("SELECT AVG(push_seconds), COUNT(*) FROM runs "
+                                       "WHERE push_result = 'pushed' AND finished >= ?", (since,)).fetchone()
+    finally:
+        conn.close()
+    return {
+        'window_seconds': window,
+        'last_push': dict(zip(('run_id', 'finished', 'push_seconds'), last_push)) if last_push else None,
+        'failures': sum(failures.values()),
+        'failures_by_class': failures,
+        'failed_pushes': failed_pushes,
+        'pushes': pushes,
+        'average_push_seconds': average,
+    }
+
+def print_status(report, now=None):
+    now = now or time.time()
+    hours = report['window_seconds'] / 3600
+    last_push = report['last_push']
+    if last_push:
+        finished = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_push['finished']))
+        print(f"Last successful push: {finished} ({(now - last_push['finished']) / 60:.0f} min ago, "
+              f"run {last_push['run_id']})")
+    else:
+        print("Last successful push: never")
+    classes = ', '.join(f"{name} {count}" for name, count in sorted(report['failures_by_class'].items()))
+    print(f"Failed runs in the last {hours:g}h: {report['failures']}" + (f" ({classes})" if classes else ''))
+    print(f"Failed pushes in the last {hours:g}h: {report['failed_pushes']}")
+    if report['pushes']:
+        print(f"Average push latency in the last {hours:g}h: {report['average_push_seconds']:.2f}s "
+              f"over {report['pushes']} push(es)")
+    else:
+        print(f"Average push latency in the last {hours:g}h: no pushes")
+
+def default_db_path():
+    # The journal is in the git dir, which is not ./.git in a linked worktree
+    try:
+        git_dir = subprocess.run(['git', 'rev-parse', '--git-dir'], check=True, capture_output=True,
+                                 text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_dir = '.git'
+    return os.path.join(git_dir, 'github_updater', 'runs.db')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show recent run status from the run journal.")
+    parser.add_argument('command', choices=['status'])
+    parser.add_argument('--db', help="run journal database (default: .git/github_updater/runs.db)")
+    parser.add_argument('--hours', type=float, default=24, help="window for failures and push latency")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+    args.db = args.db or default_db_path()
+    if not os.path.exists(args.db):
+        parser.exit(1, f"No run journal at {args.db}\n")
+    report = status(args.db, window=args.hours * 3600)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_status(report)
@@ -0,0 +1,209 @@
+import fcntl
+import logging
+import os
+import time
+
+class RunLockTimeout(Exception):
+    pass
+
+class RunLock:
+    # Serializes runs against one repository. Every caller takes a ticket in
+    # queue/ named after its arrival time; only the oldest live ticket may try
+    # the flock, so waiting runs go in arrival order. The queue is bounded in
+    # both length and waiting time, and tickets left by dead processes are
+    # dropped so a crashed run never blocks the ones behind it.
+    #
+    # The lock holder may claim waiting tickets (claim_waiters) to do their
+    # work itself; a claimable waiter whose ticket was claimed returns from
+    # acquire() with `coalesced` set and without holding the lock, and with
+    # `claimed_by` set to the holder's owner label (its pid by default). It
+    # then waits in wait_for_outcome() for the holder's report_outcome(), so
+    # it only counts as done once its commit has really been made.
+
+    def __init__(self, lock_dir, max_waiters=10, timeout=900, poll_interval=0.2, claimable=False, owner=None):
+        self.lock_dir = lock_dir
+        self.queue_dir = os.path.join(lock_dir, 'queue')
+        self.claimed_dir = os.path.join(lock_dir, 'claimed')
+        self.results_dir = os.path.join(lock_dir, 'results')
+        self.max_waiters = max_waiters
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.claimable = claimable
+        self.owner = owner or str(os.getpid())
+        self.ticket = None
+        self.coalesced = False
+        self.claimed_by = None
+        self.claimed_tickets = []
+        self._lock_file = None
+
+    def _live_tickets(self):
+        tickets = []
+        for name in sorted(os.listdir(self.queue_dir)):
+            try:
+                pid = int(name.rsplit('-', 1)[1])
+                os.kill(pid, 0)
+            except (ValueError, IndexError, ProcessLookupError):
+                self._remove_ticket(name)
+                continue
+            except PermissionError:
+                pass  # alive, owned by another user
+            tickets.append(name)
+        return tickets
+
+    def _remove_ticket(self, name):
+        try:
+            os.unlink(os.path.join(self.queue_dir, name))
+        except FileNotFoundError:
+            pass
+
+    def _check_claimed(self):
+        claim = os.path.join(self.claimed_dir, self.ticket)
+        try:
+            with open(claim) as f:
+                self.claimed_by = f.read().strip()
+        except FileNotFoundError:
+            return False
+        os.unlink(claim)
+        return True
+
+    def claim_waiters(self, limit):
+        # Take over up to `limit` waiting runs, oldest first; returns how many
+        os.makedirs(self.claimed_dir, exist_ok=True)
+        claimed = 0
+        for ticket in self._live_tickets():
+            if claimed >= limit:
+                break
+            try:
+                with open(os.path.join(self.queue_dir, ticket)) as f:
+                    if f.read() != 'claimable':
+                        continue
+                with open(os.path.join(self.claimed_dir, ticket), 'w') as f:
+                    f.write(self.owner)
+                os.unlink(os.path.join(self.queue_dir, ticket))
+            except FileNotFoundError:
+                # The waiter gave up in the meantime
+                self._remove_claim(ticket)
+                continue
+            self.claimed_tickets.append(ticket)
+            claimed += 1
+        return claimed
+
+    def report_outcome(self, outcome):
+        # Tell the runs claimed by this holder how their commits went; called
+        # before the lock is released
+        os.makedirs(self.results_dir, exist_ok=True)
+        for ticket in self.claimed_tickets:
+            try:
+                os.kill(int(ticket.rsplit('-', 1)[1]), 0)
+            except ProcessLookupError:
+                continue  # nobody left to read it
+            except PermissionError:
+                pass
+            path = os.path.join(self.results_dir, ticket)
+            with open(f'{path}.tmp', 'w') as f:
+                f.write(outcome)
+            os.replace(f'{path}.tmp', path)
+        self.claimed_tickets = []
+
+    def _read_result(self):
+        path = os.path.join(self.results_dir, self.ticket)
+        try:
+            with open(path) as f:
+                outcome = f.read().strip()
+        except FileNotFoundError:
+            return None
+        os.unlink(path)
+        return outcome
+
+    def wait_for_outcome(self):
+        # For a coalesced run: the holder's outcome, once it has reported it.
+        # If the lock comes free without a report the holder died, and the
+        # claimed commit was never made.
+        deadline = time.monotonic() + self.timeout
+        try:
+            while True:
+                outcome = self._read_result()
+                if outcome:
+                    return outcome
+                try:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    pass
+                else:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    return self._read_result() or 'failed'
+                if time.monotonic() >= deadline:
+                    logging.error(f"Timed out after {self.timeout} seconds waiting for run {self.claimed_by}")
+                    return 'failed'
+                time.sleep(self.poll_interval)
+        finally:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _remove_claim(self, ticket):
+        try:
+            os.unlink(os.path.join(self.claimed_dir, ticket))
+        except FileNotFoundError:
+            pass
+
+    def _coalesce(self):
+        logging.info(f"Run {self.ticket} was merged into run {self.claimed_by}")
+        self.coalesced = True
+        # The lock file stays open for wait_for_outcome()
+        return self
+
+    def acquire(self):
+        os.makedirs(self.queue_dir, exist_ok=True)
+        os.makedirs(self.claimed_dir, exist_ok=True)
+        self._lock_file = open(os.path.join(self.lock_dir, 'run.lock'), 'a')
+        self.ticket = f'{time.time_ns():020d}-{os.getpid()}'
+        with open(os.path.join(self.queue_dir, self.ticket), 'w') as f:
+            f.write('claimable' if self.claimable else '')
+
+        deadline = time.monotonic() + self.timeout
+        logged_position = None
+        try:
+            while True:
+                if self._check_claimed():
+                    return self._coalesce()
+                tickets = self._live_tickets()
+                position = tickets.index(self.ticket) if self.ticket in tickets else 0
+                if position > self.max_waiters:
+                    raise RunLockTimeout(f"{position} runs are already waiting for the repository")
+                if position == 0:
+                    try:
+                        fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        if self._check_claimed():
+                            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                            return self._coalesce()
+                        self._remove_ticket(self.ticket)
+                        logging.debug(f"Acquired run lock {self.ticket}")
+                        return self
+                    except BlockingIOError:
+                        pass
+                if position != logged_position:
+                    logging.info(f"Waiting for the repository, position {position} in the run queue")
+                    logged_position = position
+                if time.monotonic() >= deadline:
+                    raise RunLockTimeout(f"Timed out after {self.timeout} seconds waiting for the repository")
+                time.sleep(self.poll_interval)
+        except BaseException:
+            self._remove_ticket(self.ticket)
+            if self._lock_file:
+                self._lock_file.close()
+            raise
+
+    def release(self):
+        if self._lock_file:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def __enter__(self):
+        # Also usable on a lock that was acquired explicitly
+        if self._lock_file is None:
+            self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
@@ -5,12 +5,18 @@ import logging
 import os
 import sys
 
-# Set up logging
-logging.basicConfig(
-    filename='output.log',
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+import events
+import log_setup
+from updater import Config, default_repo_path
+
+# Where commit_file.py lives; its events.jsonl is shared with the runs
+HOME_DIR = default_repo_path()
+EVENTS_FILE = os.path.join(HOME_DIR, Config.EVENTS_FILE)
+
+def plan_run_times(start, min_runs=0, max_runs=35):
+    # Pick a random number of run times spread over the 24 hours after `start`
+    num_runs = random.randint(min_runs, max_runs)
+    return sorted([start + timedelta(seconds=random.randint(0, 86400)) for _ in range(num_runs)])
 
 def schedule_commit_script():
     try:
@@ -27,29 +33,33 @@ def schedule_commit_script():
         os.environ["PATH"] = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin:/usr/games:/usr/local/games:/snap/bin"
         logging.debug(f"Updated PATH: {os.environ.get('PATH')}")
 
-        # Log the current environment variables
-        logging.debug(f"Environment variables: {os.environ}")
+        # Log the environment variables that matter
+        logging.debug(f"Environment variables: {log_setup.environment_summary()}")
 
-        # Determine the number of times to run the script today
-        num_runs = random.randint(0, 35)
-        logging.debug(f'Number of runs scheduled for today: {num_runs}')
-        
         # Get the current time
         now = datetime.now()
         logging.debug(f'Current time: {now}')
         
         # Calculate the time intervals for running the script
-        intervals = sorted([now + timedelta(seconds=random.randint(0, 86400)) for _ in range(num_runs)])
+        intervals = plan_run_times(now)
+        logging.debug(f'Number of runs scheduled for today: {len(intervals)}')
         logging.debug(f'Scheduled intervals: {intervals}')
         
         # Schedule the script to run at the calculated times
         for run_time in intervals:
             run_time_str = run_time.strftime('%H:%M')
-            # Construct the command to schedule with `at`
+            # `at` starts jobs at the top of the minute
+            scheduled_at = run_time.replace(second=0, microsecond=0).timestamp()
+            run_id = events.new_run_id()
+            # Construct the command to schedule with `at`. commit_file.py logs
+            # to commit_output.log itself; appending its stdout there as well
+            # would keep writing to the file after it has been rotated. The
+            # run ID and slot are passed on so the run's events can be
+            # matched with this one.
             command = (
                 f'echo "PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin; '
-                f'/usr/bin/python3 /home/don/workspaces/github_updater/commit_file.py '
-                f'>> /home/don/workspaces/github_updater/commit_output.log 2>&1" | at {run_time_str}'
+                f'{events.RUN_ID_ENV}={run_id} {events.SCHEDULED_AT_ENV}={scheduled_at:.0f} '
+                f'/usr/bin/python3 {HOME_DIR}/commit_file.py" | at {run_time_str}'
             )
             logging.debug(f'Scheduling command: {command}')
             
@@ -58,9 +68,12 @@ def schedule_commit_script():
             
             # Log the result
             if result.returncode == 0:
+                events.emit(EVENTS_FILE, 'run_scheduled', run_id, scheduled_at=scheduled_at, scheduler='at')
                 logging.info(f'Successfully scheduled commit_file.py to run at {run_time_str}')
                 logging.debug(f'Command output: {result.stdout.strip()}')
             else:
+                events.emit(EVENTS_FILE, 'schedule_failed', run_id, scheduled_at=scheduled_at,
+                            error=result.stderr.strip())
                 logging.error(f'Failed to schedule commit_file.py at {run_time_str}')
                 logging.error(f'Command output: {result.stdout.strip()}')
                 logging.error(f'Command error: {result.stderr.strip()}')
@@ -68,4 +81,6 @@ def schedule_commit_script():
         logging.error(f'An error occurred: {e}', exc_info=True)
 
 if __name__ == "__main__":
+    # Set up logging, rotated and compressed like commit_output.log
+    log_setup.setup_logging('output.log', os.environ.get('GITHUB_UPDATER_LOG_LEVEL', 'INFO'))
     schedule_commit_script()
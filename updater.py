@@ -0,0 +1,804 @@
+import subprocess
+import glob
+import random
+import logging
+import time
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import events
+import log_setup
+from git_runner import GitRunner, gather_fail_fast
+from log_stats import classify
+import metrics
+import payload
+import run_journal
+from message_corpus import MessageCorpus, ShuffleBag
+from plumbing_commit import PlumbingCommitter
+from preflight_cache import cached_check_async, file_mtimes, invalidate
+from push_queue import clear_queue, enqueue_commits, load_queue, push_due
+from repo_state import probe_repo_state
+from run_lock import RunLock, RunLockTimeout
+
+# Where the repository lives unless a path is given: GITHUB_UPDATER_HOME, or
+# the directory this file is in
+HOME_ENV = 'GITHUB_UPDATER_HOME'
+
+def default_repo_path():
+    return os.environ.get(HOME_ENV) or os.path.dirname(os.path.abspath(__file__))
+
+class Config:
+    # Settings for one repository. Relative paths are relative to the
+    # repository; any setting can be overridden per Updater, e.g.
+    # Updater(path, PUSH_POLICY='count').
+    GIT_TIMEOUT = 30  # seconds
+    MAX_RETRIES = 3
+    RETRY_DELAY = 5
+    COMMIT_ENGINE = 'plumbing'  # 'plumbing' (hash-object/mktree/commit-tree) or 'porcelain' (git add + git commit)
+    MAX_FILE_SIZE = 512 * 1024  # bytes per update file, 0 lets files grow without limit
+    PREPARE_DURING_PULL = True  # generate the payloads into PAYLOAD_SPOOL_DIR while the pull runs
+    MAX_UPDATE_LENGTH = 200  # most random characters appended to one file per commit
+    ROTATION_POLICY = 'trim'  # 'trim' drops the oldest lines, 'segment' continues in file.<n>.<ext>
+    STATE_DIR = os.path.join('.git', 'github_updater')  # run lock, queue and other local state
+    RUN_QUEUE_LIMIT = 10  # runs allowed to wait for the repository at once
+    RUN_LOCK_TIMEOUT = 900  # seconds a run waits for the repository before giving up
+    RUN_DEADLINE = 600  # seconds a run may take once it has the lock; git commands still running then are killed
+    MAX_COALESCED_COMMITS = 10  # most commits one run makes for itself and the runs merged into it
+    PUSH_POLICY = 'immediate'  # 'immediate', 'count' (every PUSH_EVERY_COMMITS) or 'interval' (every PUSH_EVERY_SECONDS)
+    PUSH_EVERY_COMMITS = 5
+    PUSH_EVERY_SECONDS = 3600
+    PUSH_QUEUE_FILE = os.path.join(STATE_DIR, 'push_queue.json')
+    PREFLIGHT_CACHE_FILE = os.path.join(STATE_DIR, 'preflight.json')
+    GIT_CONFIG_CACHE_TTL = 86400  # seconds a successful user.name/user.email check is trusted
+    REMOTE_CHECK_CACHE_TTL = 60  # seconds a remote branch lookup is reused, e.g. by retries
+    MESSAGE_FILE = 'commit_messages.txt'
+    MESSAGE_SAMPLING = 'bag'  # 'bag' uses every message once before repeating, 'random' picks independently
+    MESSAGE_BAG_FILE = os.path.join(STATE_DIR, 'message_bag.bin')
+    PAYLOAD_SPOOL_DIR = os.path.join(STATE_DIR, 'payloads')  # emptied at the end of every run
+    GIT_CONFIG_FILES = [os.path.join('.git', 'config'), '~/.gitconfig', '~/.config/git/config']
+    METRICS_TEXTFILE = os.path.join(STATE_DIR, 'metrics.prom')  # Prometheus textfile for the last run, None to disable
+    METRICS_JSONL = os.path.join(STATE_DIR, 'metrics.jsonl')  # one JSON line per run, None to disable
+    METRICS_JSONL_MAX_BYTES = 5 * 1024 * 1024  # gzipped to metrics.jsonl.1.gz when it reaches this, 0 never
+    METRICS_JSONL_BACKUP_COUNT = 14  # gzipped copies kept
+    EVENTS_FILE = 'events.jsonl'  # JSON events shared with schedule_commit.py
+    RUN_JOURNAL = os.path.join(STATE_DIR, 'runs.db')  # SQLite journal with one row per run, None to disable
+    GIT_OUTPUT = 'summary'  # 'summary' logs one line per git command, 'raw' logs its full output
+    GIT_SUMMARY_LENGTH = 200  # characters of git output kept in a summary line
+
+    def __init__(self, **settings):
+        for name, value in settings.items():
+            if not hasattr(Config, name):
+                raise TypeError(f"Unknown setting: {name}")
+            setattr(self, name, value)
+
+class RemoteUnavailable(Exception):
+    pass
+
+class PushRejected(Exception):
+    pass
+
+def is_segment(path):
+    return re.fullmatch(r'file\.\d+\.[^.]+', os.path.basename(path)) is not None
+
+def segment_path(target, number):
+    base, ext = os.path.splitext(target)
+    return f'{base}.{number}{ext}' if number else target
+
+# One update is a comment line of random characters
+UPDATE_PREFIX = b'\n# '
+UPDATE_SUFFIX = b'\n'
+
+def update_size(length):
+    # Bytes an update of `length` random characters adds to a file
+    return len(UPDATE_PREFIX) + length + len(UPDATE_SUFFIX)
+
+def write_update(f, length):
+    # Streamed in chunks, so memory stays the same however long the update is
+    f.write(UPDATE_PREFIX)
+    payload.write_random_bytes(f, length)
+    f.write(UPDATE_SUFFIX)
+
+def update_text(length):
+    # The same update in memory, for backfill.py, which builds whole files
+    return UPDATE_PREFIX + payload.random_bytes(length) + UPDATE_SUFFIX
+
+def trim_to_fit(data, incoming, max_size):
+    # Drop whole lines from the start until `incoming` more bytes fit in max_size
+    excess = len(data) + incoming - max_size
+    if excess <= 0:
+        return data
+    cut = data.find(b'\n', excess - 1)
+    return data[cut + 1:] if cut != -1 else b''
+
+def trim_file(path, incoming, max_size, chunk_size=payload.CHUNK_SIZE):
+    # trim_to_fit on a file, read and copied a chunk at a time
+    excess = os.path.getsize(path) + incoming - max_size
+    if excess <= 0:
+        return
+    tmp_path = f'{path}.tmp'
+    with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        offset = excess - 1
+        src.seek(offset)
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break  # no line ends past the excess: nothing is kept
+            newline = chunk.find(b'\n')
+            if newline != -1:
+                src.seek(offset + newline + 1)
+                shutil.copyfileobj(src, dst, chunk_size)
+                break
+            offset += len(chunk)
+    shutil.copymode(path, tmp_path)
+    os.replace(tmp_path, path)
+
+class Updater:
+    # A session on one repository: its path and settings, the long-lived git
+    # processes and message corpus reused from run to run, the state from the
+    # last probe and the metrics of the current run. Every git command runs
+    # in the repository through self.run (a GitRunner, under the run's
+    # deadline), so nothing depends on the working directory and nothing
+    # happens on import; commit_daemon.py keeps one Updater for its whole
+    # life. Paths of update files are relative to the
+    # repository, as git sees them.
+
+    def __init__(self, path, **settings):
+        self.path = os.path.abspath(path)
+        self.config = Config(**settings)
+        self.metrics = metrics.RunMetrics()
+        self.git = GitRunner(self.metrics, cwd=self.path, default_timeout=self.config.RUN_DEADLINE)
+        self.state = None
+        self._message_corpus = None
+        self._plumbing_committer = None
+        self._prepare_executor = None
+        self._git_dirs = None
+
+    def close(self):
+        if self._prepare_executor is not None:
+            self._prepare_executor.shutdown(wait=True)
+            self._prepare_executor = None
+        if self._plumbing_committer is not None:
+            self._plumbing_committer.close()
+            self._plumbing_committer = None
+        if self._message_corpus is not None:
+            self._message_corpus.close()
+            self._message_corpus = None
+        self.git.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def git_dirs(self):
+        # (git dir, common dir). .git is a file in linked worktrees and
+        # submodules, so git is asked once per session where they really are
+        if self._git_dirs is None:
+            try:
+                result = subprocess.run(['git', 'rev-parse', '--git-dir', '--git-common-dir'], cwd=self.path,
+                                        check=True, capture_output=True, text=True, timeout=self.config.GIT_TIMEOUT)
+                git_dir, common_dir = result.stdout.splitlines()
+                self._git_dirs = os.path.join(self.path, git_dir), os.path.join(self.path, common_dir)
+            except (OSError, ValueError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+                # Not a repository; the status probe reports that (state.is_repo)
+                return os.path.join(self.path, '.git'), os.path.join(self.path, '.git')
+        return self._git_dirs
+
+    def repo_path(self, path):
+        # Paths under .git/ go to this worktree's git dir, except the config,
+        # which all worktrees share
+        path = os.path.expanduser(path)
+        head, sep, rest = path.partition(os.sep)
+        if head == '.git' and sep:
+            git_dir, common_dir = self.git_dirs()
+            return os.path.join(common_dir if rest == 'config' else git_dir, rest)
+        return os.path.join(self.path, path)
+
+    @property
+    def events_file(self):
+        return self.repo_path(self.config.EVENTS_FILE)
+
+    def run(self, args, **kwargs):
+        # Like subprocess.run, in the repository, recorded in this run's metrics
+        return self.git.run(args, **kwargs)
+
+    def list_update_files(self):
+        # Segments belong to their base file and are not separate targets
+        return [os.path.relpath(file, self.path) for file in glob.glob(self.repo_path('update_files/file.*'))
+                if not is_segment(file)]
+
+    def active_segment(self, target):
+        number = 0
+        while os.path.exists(self.repo_path(segment_path(target, number + 1))):
+            number += 1
+        return number
+
+    def rotate_target(self, target, incoming):
+        # Return the path the next `incoming` bytes for `target` should be appended to
+        max_file_size = self.config.MAX_FILE_SIZE
+        if not max_file_size:
+            return target
+        if self.config.ROTATION_POLICY == 'segment':
+            number = self.active_segment(target)
+            path = segment_path(target, number)
+            size = os.path.getsize(self.repo_path(path))
+            if size and size + incoming > max_file_size:
+                path = segment_path(target, number + 1)
+                logging.info(f"{segment_path(target, number)} reached {max_file_size} bytes, continuing in {path}")
+            return path
+        if os.path.getsize(self.repo_path(target)) + incoming > max_file_size:
+            trim_file(self.repo_path(target), incoming, max_file_size)
+            logging.info(f"Trimmed {target} to stay under {max_file_size} bytes")
+        return target
+
+    def plan_file_updates(self, files):
+        # Pick a random selection of files and how many random characters to
+        # append to each; the text itself is only generated as it is written
+        num_files_to_update = random.randint(1, len(files))
+        files_to_update = random.sample(files, num_files_to_update)
+        return [(file, random.randint(1, self.config.MAX_UPDATE_LENGTH)) for file in files_to_update]
+
+    def prepare_updates(self):
+        # Pick the files and lengths for one commit; nothing is written yet
+        try:
+            logging.debug("Preparing file updates...")
+            return self.plan_file_updates(self.list_update_files())
+        except Exception as e:
+            logging.error(f'An error occurred while preparing file updates: {e}')
+            raise
+
+    def apply_updates(self, updates):
+        try:
+            logging.debug("Starting file update operation...")
+            # The pull may have removed a file since the updates were planned
+            missing = [update[0] for update in updates if not os.path.exists(self.repo_path(update[0]))]
+            if missing:
+                logging.warning(f"Update files gone after the pull, planning again: {missing}")
+                updates = self.prepare_updates()
+
+            files_to_update = []
+            for update in updates:
+                # (target, length), or (target, length, spool file) if it was generated ahead
+                target, length = update[:2]
+                size = update_size(length)
+                file = self.rotate_target(target, size)
+                with open(self.repo_path(file), 'ab') as f:
+                    if len(update) > 2:
+                        with open(update[2], 'rb') as spooled:
+                            shutil.copyfileobj(spooled, f, payload.CHUNK_SIZE)
+                    else:
+                        write_update(f, length)
+                self.metrics.count_appended(file, size)
+                files_to_update.append(file)
+
+            logging.info(f'Updated files: {files_to_update}')
+            logging.debug("File update operation completed.")
+            return files_to_update
+        except Exception as e:
+            logging.error(f'An error occurred while updating files: {e}')
+            raise
+
+    def update_files(self):
+        return self.apply_updates(self.prepare_updates())
+
+    def get_message_corpus(self):
+        # Read through its line-offset index, kept open between runs and
+        # reindexed when the file changes
+        if self._message_corpus is None:
+            self._message_corpus = MessageCorpus(self.repo_path(self.config.MESSAGE_FILE))
+        return self._message_corpus
+
+    def next_commit_message(self):
+        if self.config.MESSAGE_SAMPLING == 'bag':
+            return ShuffleBag(self.get_message_corpus(), self.repo_path(self.config.MESSAGE_BAG_FILE)).next_message()
+        return self.get_message_corpus().random_message()
+
+    def get_random_commit_message(self):
+        try:
+            commit_message = self.next_commit_message()
+            logging.info(f'Commit message: {commit_message}')
+            return commit_message
+        except Exception as e:
+            logging.error(f'An error occurred while getting commit message: {e}')
+            raise
+
+    def prepare_commit(self):
+        # Plans one commit and generates its payloads into spool files, so
+        # applying them after the pull is a plain copy; memory stays at one
+        # chunk however large they are. The message is drawn later: a bag
+        # draw is permanent, and the pull may still fail.
+        start = time.monotonic()
+        spool_dir = self.repo_path(self.config.PAYLOAD_SPOOL_DIR)
+        os.makedirs(spool_dir, exist_ok=True)
+        prepared = []
+        for target, length in self.prepare_updates():
+            fd, path = tempfile.mkstemp(dir=spool_dir)
+            with os.fdopen(fd, 'wb') as f:
+                write_update(f, length)
+            prepared.append((target, length, path))
+        self.metrics.record_phase('prepare', time.monotonic() - start)
+        return prepared
+
+    def clear_payload_spool(self):
+        # Left over when a run fails or crashes; only the lock holder writes here
+        shutil.rmtree(self.repo_path(self.config.PAYLOAD_SPOOL_DIR), ignore_errors=True)
+
+    def start_preparing(self, commits):
+        # Prepares `commits` commits on a worker thread; returns a future of the list
+        if self._prepare_executor is None:
+            self._prepare_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f'{os.path.basename(self.path)}-prepare')
+        return self._prepare_executor.submit(lambda: [self.prepare_commit() for _ in range(commits)])
+
+    def log_git_output(self, args, output, level):
+        lines = [line.strip() for line in (output or '').splitlines() if line.strip()]
+        if not lines:
+            return
+        if self.config.GIT_OUTPUT == 'raw':
+            logging.log(level, f"git {args[1]} output:\n{output.rstrip()}")
+            return
+        summary = ' | '.join(lines)
+        if len(summary) > self.config.GIT_SUMMARY_LENGTH:
+            summary = summary[:self.config.GIT_SUMMARY_LENGTH - 3] + '...'
+        logging.log(level, f"git {args[1]}: {summary}")
+
+    def run_git(self, args, **kwargs):
+        # For git commands whose output used to go straight to stdout: capture
+        # it (stderr included) and log it according to GIT_OUTPUT
+        try:
+            result = self.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, **kwargs)
+        except subprocess.CalledProcessError as e:
+            self.log_git_output(args, e.stdout, logging.ERROR)
+            raise
+        self.log_git_output(args, result.stdout, logging.INFO)
+        return result
+
+    # The preflight checks are coroutines so that preflight() can run them
+    # side by side. Whether this is a repository at all comes from the
+    # status probe (state.is_repo).
+
+    async def check_git_config_async(self):
+        try:
+            # Check if user.name and user.email are configured, both at once
+            options = {'check': True, 'capture_output': True, 'timeout': self.config.GIT_TIMEOUT}
+            await self.git.run_all_async([(['git', 'config', 'user.name'], options),
+                                          (['git', 'config', 'user.email'], options)])
+            return True
+        except subprocess.CalledProcessError:
+            logging.error("Git user.name or user.email is not configured")
+            return False
+
+    async def verify_git_config_async(self):
+        # Cached until the TTL runs out or one of the git config files changes
+        return await cached_check_async(self.repo_path(self.config.PREFLIGHT_CACHE_FILE), 'git_config',
+                                        self.config.GIT_CONFIG_CACHE_TTL,
+                                        file_mtimes([self.repo_path(path) for path in self.config.GIT_CONFIG_FILES]),
+                                        self.check_git_config_async)
+
+    async def get_remote_branch_head_async(self, branch):
+        # Reuse a recent answer (e.g. on retries) unless the repository config changed
+        return await cached_check_async(self.repo_path(self.config.PREFLIGHT_CACHE_FILE), 'remote_head',
+                                        self.config.REMOTE_CHECK_CACHE_TTL,
+                                        [branch] + file_mtimes([self.repo_path(os.path.join('.git', 'config'))]),
+                                        lambda: self.fetch_remote_branch_head_async(branch))
+
+    async def fetch_remote_branch_head_async(self, branch):
+        # Ask the remote for just this branch; None if the remote cannot be reached
+        try:
+            result = await self.git.run_async(['git', 'ls-remote', 'origin', f'refs/heads/{branch}'], check=True,
+                                              capture_output=True, text=True, timeout=self.config.GIT_TIMEOUT)
+            return result.stdout.split('\t', 1)[0].strip()
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            logging.error(f"Failed to access remote repository: {e}")
+            return None
+
+    async def get_tracking_head_async(self, branch):
+        result = await self.git.run_async(['git', 'rev-parse', '--verify', '--quiet', f'refs/remotes/origin/{branch}'],
+                                          capture_output=True, text=True, timeout=self.config.GIT_TIMEOUT)
+        return result.stdout.strip()
+
+    async def preflight_async(self, branch):
+        # The git config check, the remote lookup and the local tracking ref
+        # are independent, so they run at the same time and the first one
+        # that fails cancels the others. Returns (remote head, tracking head).
+        async def git_config():
+            if not await self.verify_git_config_async():
+                raise Exception("Git configuration is incomplete")
+
+        async def remote_head():
+            head = await self.get_remote_branch_head_async(branch)
+            if head is None:
+                raise RemoteUnavailable("Cannot access remote repository")
+            return head
+
+        _, remote, tracking = await gather_fail_fast(git_config(), remote_head(), self.get_tracking_head_async(branch))
+        return remote, tracking
+
+    def preflight(self, branch):
+        return self.git.run_coroutine(self.preflight_async(branch))
+
+    def get_head(self):
+        return self.run(['git', 'rev-parse', 'HEAD'], check=True, capture_output=True, text=True,
+                        timeout=self.config.GIT_TIMEOUT).stdout.strip()
+
+    def get_repo_state(self):
+        return probe_repo_state(self.run, timeout=self.config.GIT_TIMEOUT)
+
+    def handle_merge_conflicts(self, state=None):
+        try:
+            # Check if there are merge conflicts
+            if state is None:
+                state = self.get_repo_state()
+            if state.unmerged:
+                logging.warning("Merge conflicts detected. Aborting rebase.")
+                self.run_git(['git', 'rebase', '--abort'], check=True, timeout=self.config.GIT_TIMEOUT)
+                return False
+            return True
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Error handling merge conflicts: {e}")
+            return False
+
+    def git_pull(self, state=None):
+        timeout = self.config.GIT_TIMEOUT
+        try:
+            if state is None:
+                state = self.get_repo_state()
+
+            if not state.is_repo:
+                raise Exception("Not a git repository")
+
+            # Get the current branch name
+            current_branch = state.branch or 'HEAD'
+
+            # Git config, remote access and the tracking ref, all at once
+            with self.metrics.phase('preflight'):
+                remote_head, tracking_head = self.preflight(current_branch)
+
+            # Nothing new upstream since the last fetch and nothing fetched but
+            # not yet rebased onto: skip the stash/pull/rebase
+            if (remote_head and remote_head == tracking_head and state.upstream == f'origin/{current_branch}'
+                    and state.behind == 0):
+                logging.info(f"origin/{current_branch} is unchanged at {remote_head[:12]}; skipping pull.")
+                return state
+
+            # Check if there are changes to stash
+            if state.dirty:
+                # Stash any uncommitted changes
+                with self.metrics.phase('stash'):
+                    stash_result = self.run(['git', 'stash', 'push', '-m', 'Auto-stash before pull'],
+                                            check=True, capture_output=True, text=True, timeout=timeout)
+                logging.info(f"Stashed changes: {stash_result.stdout.strip()}")
+                stash_applied = True
+            else:
+                logging.info("No changes to stash.")
+                stash_applied = False
+
+            # Run the git pull command with --rebase and specify the current branch
+            with self.metrics.phase('rebase'):
+                result = self.run(['git', 'pull', '--rebase', 'origin', current_branch],
+                                  check=True, capture_output=True, text=True, timeout=timeout)
+            logging.info(f"Successfully pulled the latest changes with rebase: {result.stdout.strip()}")
+
+            # Check for merge conflicts after pull
+            with self.metrics.phase('conflict_check'):
+                state = self.get_repo_state()
+                if not self.handle_merge_conflicts(state):
+                    raise Exception("Merge conflicts detected during pull")
+
+            # Reapply the stashed changes if a stash was created
+            if stash_applied:
+                with self.metrics.phase('unstash'):
+                    try:
+                        pop_result = self.run(['git', 'stash', 'pop'],
+                                              check=True, capture_output=True, text=True, timeout=timeout)
+                        logging.info(f"Reapplied stashed changes: {pop_result.stdout.strip()}")
+                    except subprocess.CalledProcessError as e:
+                        logging.error(f"Failed to apply stashed changes: {e}")
+                        # Try to recover the stash
+                        self.run_git(['git', 'stash', 'apply'], check=True, timeout=timeout)
+                        raise
+            return state
+        except subprocess.TimeoutExpired:
+            logging.error("Git operation timed out")
+            raise
+        except subprocess.CalledProcessError as e:
+            logging.error(f"An error occurred during git pull or stash operations: {e}")
+            logging.error(f"Command output: {e.stdout.strip()}")
+            logging.error(f"Command error: {e.stderr.strip()}")
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error during git pull: {e}")
+            raise
+
+    def git_pull_with_retry(self, state=None, retries=None, delay=None):
+        retries = self.config.MAX_RETRIES if retries is None else retries
+        delay = self.config.RETRY_DELAY if delay is None else delay
+        last_error = None
+        for attempt in range(retries):
+            try:
+                # A failed attempt may have stashed or rebased, so probe again
+                if attempt > 0:
+                    state = None
+                    self.metrics.count_retry('pull')
+                return self.git_pull(state)  # Exit the function if git_pull succeeds
+            except Exception as e:
+                last_error = e
+                logging.error(f"Attempt {attempt + 1} failed: {e}")
+                if attempt < retries - 1:
+                    logging.info(f"Retrying in {delay} seconds...")
+                    time.sleep(delay)
+                else:
+                    logging.warning("All retry attempts failed. Continuing the process.")
+        if last_error:
+            raise last_error
+
+    def get_plumbing_committer(self):
+        # Long-lived plumbing processes, reused by every commit of this session
+        if self._plumbing_committer is None:
+            self._plumbing_committer = PlumbingCommitter(self.git, cwd=self.path, timeout=self.config.GIT_TIMEOUT)
+        return self._plumbing_committer
+
+    def git_commit(self, file_paths, commit_message, state=None):
+        try:
+            logging.debug("Starting git commit operation...")
+            if self.config.COMMIT_ENGINE == 'plumbing':
+                if state is None:
+                    state = self.get_repo_state()
+                # Build the commit directly from the changed files, bypassing the index refresh
+                with self.metrics.phase('commit'):
+                    state.head = self.get_plumbing_committer().commit(file_paths, commit_message, state.head)
+                if state.upstream:
+                    state.ahead += 1
+            else:
+                # Add the files to the staging area
+                with self.metrics.phase('add'):
+                    self.run_git(['git', 'add'] + file_paths, check=True)
+
+                # Commit the files with the provided commit message
+                with self.metrics.phase('commit'):
+                    self.run_git(['git', 'commit', '-m', commit_message], check=True)
+                if state is not None:
+                    state.head = self.get_head()
+
+            logging.info("Files committed successfully.")
+            logging.debug("Git commit operation completed.")
+        except subprocess.CalledProcessError as e:
+            logging.error(f'An error occurred during git operations: {e}')
+            raise
+
+    def git_push(self):
+        try:
+            # Push the changes to the remote repository
+            with self.metrics.phase('push'):
+                self.run_git(['git', 'push'], check=True, timeout=self.config.GIT_TIMEOUT)
+            # The remote branch has moved; don't compare against the cached head
+            invalidate(self.repo_path(self.config.PREFLIGHT_CACHE_FILE), 'remote_head')
+            logging.info("Changes pushed successfully.")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            logging.error(f'An error occurred during git push: {e}')
+            raise
+
+    def git_commit_and_push(self, file_paths, commit_message, state=None):
+        self.git_commit(file_paths, commit_message, state)
+        self.git_push()
+
+    def push_queue_due(self):
+        return push_due(load_queue(self.repo_path(self.config.PUSH_QUEUE_FILE)), self.config.PUSH_POLICY,
+                        self.config.PUSH_EVERY_COMMITS, self.config.PUSH_EVERY_SECONDS)
+
+    def flush_push_queue(self, force=False):
+        # Push the queued commits if the push policy says it is time. An
+        # unreachable remote keeps them queued for the next attempt instead of
+        # failing the run; a rejection (the remote has moved on) fails the run
+        # and makes the next one ask the remote again, so it pulls first
+        queue_file = self.repo_path(self.config.PUSH_QUEUE_FILE)
+        queue = load_queue(queue_file)
+        if not queue['pending']:
+            return True
+        if not force and not push_due(queue, self.config.PUSH_POLICY, self.config.PUSH_EVERY_COMMITS,
+                                      self.config.PUSH_EVERY_SECONDS):
+            logging.info(f"{queue['pending']} commit(s) waiting in the push queue ({self.config.PUSH_POLICY} policy).")
+            return True
+        try:
+            self.git_push()
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            self.metrics.record_error('push', e)
+            if isinstance(e, subprocess.CalledProcessError) and classify(e.stdout or '') == 'push_rejected':
+                invalidate(self.repo_path(self.config.PREFLIGHT_CACHE_FILE), 'remote_head')
+                raise PushRejected(f"Updates were rejected by the remote; {queue['pending']} commit(s) stay "
+                                   f"in the push queue until the next run pulls") from e
+            logging.warning(f"Push failed; {queue['pending']} commit(s) stay in the push queue.")
+            return False
+        clear_queue(queue_file)
+        return True
+
+    def ensure_clean_working_directory(self, state=None):
+        try:
+            if state is None:
+                state = self.get_repo_state()
+            if state.dirty:
+                logging.error("Working directory is not clean. Please commit or stash changes before pulling.")
+                raise Exception("Working directory is not clean.")
+            logging.info("Working directory is clean.")
+        except subprocess.CalledProcessError as e:
+            logging.error(f"An error occurred while checking the working directory: {e}")
+            raise
+
+    def auto_commit_changes(self, state=None):
+        try:
+            # Check for uncommitted changes
+            if state is None:
+                state = self.get_repo_state()
+            if state.dirty:
+                # Stage all changes
+                self.run_git(['git', 'add', '.'], check=True)
+                # Commit the changes
+                self.run_git(['git', 'commit', '-m', 'Auto-commit before pull'], check=True)
+                # The plumbing engine builds on state.head, which has just moved
+                state.mark_committed(self.get_head())
+                logging.info("Automatically committed uncommitted changes.")
+            else:
+                logging.info("No uncommitted changes to commit.")
+            return state
+        except subprocess.CalledProcessError as e:
+            logging.error(f"An error occurred during auto-commit: {e}")
+            raise
+
+    def clean_untracked_files(self):
+        try:
+            self.run_git(['git', 'clean', '-fd'], check=True)
+            logging.info("Removed untracked files.")
+        except subprocess.CalledProcessError as e:
+            logging.error(f"An error occurred while cleaning untracked files: {e}")
+            raise
+
+    def get_run_lock(self, claimable=False, owner=None):
+        return RunLock(self.repo_path(self.config.STATE_DIR), max_waiters=self.config.RUN_QUEUE_LIMIT,
+                       timeout=self.config.RUN_LOCK_TIMEOUT, claimable=claimable, owner=owner)
+
+    def export_metrics(self, outcome, run_id, commits=0, commit_sha=None, **fields):
+        summary = self.metrics.summarize(outcome)
+        if self.config.RUN_JOURNAL:
+            run_journal.record_run(self.repo_path(self.config.RUN_JOURNAL), summary, commits, commit_sha)
+        try:
+            if self.config.METRICS_JSONL:
+                metrics.append_jsonl(self.repo_path(self.config.METRICS_JSONL), summary,
+                                     self.config.METRICS_JSONL_MAX_BYTES, self.config.METRICS_JSONL_BACKUP_COUNT)
+            # A merged run did no work of its own; keep the textfile on the run that did
+            if self.config.METRICS_TEXTFILE and outcome != 'coalesced':
+                metrics.write_textfile(self.repo_path(self.config.METRICS_TEXTFILE), summary)
+        except OSError as e:
+            logging.warning(f"Could not write metrics: {e}")
+        events.emit(self.events_file, 'run_finished', run_id, outcome=outcome, seconds=summary['seconds'],
+                    commits=commits, git_commands=len(summary['commands']), **fields)
+        # A merged run's line must not close whatever run log_stats has open
+        label = 'Merged run' if outcome == 'failed' and 'into' in fields else 'Run'
+        logging.info(f"{label} {outcome} after {summary['seconds']:.3f}s "
+                     f"and {len(summary['commands'])} git command(s).")
+        # Errors have already written out the detail; otherwise it is not needed
+        log_setup.discard_buffered_records()
+
+    def run_commit_cycle(self, commits=1, run_id=None, scheduled_at=None):
+        # run_id and scheduled_at come from the scheduler when it started this run
+        run_id = run_id or events.new_run_id()
+        started = time.time()
+        self.metrics.start_run(run_id)
+        events.emit(self.events_file, 'run_started', run_id, scheduled_at=scheduled_at,
+                    lag=started - scheduled_at if scheduled_at else None, commits=commits)
+
+        # Overlapping runs queue up for the repository instead of racing on .git/index.lock
+        try:
+            with self.metrics.phase('lock_wait'):
+                lock = self.get_run_lock(claimable=True, owner=run_id).acquire()
+        except RunLockTimeout as e:
+            logging.error(f"Skipping this run: {e}")
+            self.export_metrics('skipped', run_id)
+            return False
+        if lock.coalesced:
+            # The run holding the repository makes this run's commit; this
+            # run ends the way that one does
+            with self.metrics.phase('merge_wait'):
+                holder_outcome = lock.wait_for_outcome()
+            if holder_outcome == 'success':
+                self.export_metrics('coalesced', run_id, into=lock.claimed_by)
+                return True
+            error = Exception(f"Run {lock.claimed_by}, which was to make this run's commit, ended {holder_outcome}")
+            self.metrics.record_error('run', error)
+            logging.error(str(error))
+            self.export_metrics('failed', run_id, into=lock.claimed_by)
+            return False
+
+        with lock:
+            outcome = 'failed'
+            made = 0
+            preparing = None
+            remote_down = False
+            self.state = None
+            # From here every git command gets at most what is left of the budget
+            self.git.start_deadline(self.config.RUN_DEADLINE)
+            try:
+                logging.info(f"Starting main process in commit_file.py (run {run_id})")
+
+                # Probe the repository once; the state is passed down the pipeline
+                with self.metrics.phase('probe'):
+                    self.state = self.get_repo_state()
+
+                # Ensure the working directory is clean or auto-commit changes
+                logging.info("Ensuring clean working directory or auto-committing changes...")
+                with self.metrics.phase('auto_commit'):
+                    self.state = self.auto_commit_changes(self.state)
+
+                # The payloads do not depend on the pull, so they are generated
+                # while it runs and appended only once it is done
+                if self.config.PREPARE_DURING_PULL:
+                    preparing = self.start_preparing(commits)
+
+                # Pull the latest changes
+                logging.info("Pulling the latest changes...")
+                try:
+                    with self.metrics.phase('pull'):
+                        self.state = self.git_pull_with_retry(self.state)
+                except RemoteUnavailable:
+                    # Keep committing locally; the push queue is drained once the remote is back
+                    logging.warning("Remote is unreachable; committing locally and queueing the push.")
+                    remote_down = True
+
+                # Runs queued behind this one get their commits here, sharing the pull and push
+                commits += lock.claim_waiters(max(0, self.config.MAX_COALESCED_COMMITS - commits))
+                if commits > 1:
+                    logging.info(f"Making {commits} commits in this run")
+
+                prepared = []
+                if preparing is not None:
+                    with self.metrics.phase('prepare_wait'):
+                        prepared = preparing.result()
+
+                for number in range(commits):
+                    # Commits of runs merged in after the pull are planned now
+                    # and written straight into the files
+                    updates = prepared[number] if number < len(prepared) else self.prepare_updates()
+
+                    # Update the files
+                    logging.info("Updating files...")
+                    with self.metrics.phase('update'):
+                        updated_files = self.apply_updates(updates)
+
+                    # Get a random commit message
+                    logging.info("Getting a random commit message...")
+                    with self.metrics.phase('message'):
+                        commit_message = self.get_random_commit_message()
+
+                    # Commit the changes
+                    logging.info("Committing changes...")
+                    self.git_commit(updated_files, commit_message, self.state)
+                    made += 1
+
+                # Queue this run's commits and push them all at once when the policy allows
+                enqueue_commits(self.repo_path(self.config.PUSH_QUEUE_FILE), commits)
+                if remote_down:
+                    # Don't wait out another timeout on a remote that just failed
+                    logging.info("Not pushing this run; the remote was unreachable during the pull.")
+                else:
+                    logging.info("Pushing changes...")
+                    self.flush_push_queue()
+
+                logging.info("Main process in commit_file.py completed successfully.")
+                outcome = 'success'
+                return True
+            except Exception as e:
+                self.metrics.record_error('run', e)
+                logging.error(f"An error occurred in the main process: {e}", exc_info=True)
+                return False
+            finally:
+                # A failed pull leaves the preparing thread to finish; its
+                # spool files are dropped, and it must not time into the next run
+                if preparing is not None:
+                    wait([preparing])
+                    self.clear_payload_spool()
+                self.git.clear_deadline()
+                self.export_metrics(outcome, run_id, made, self.state.head if self.state and made else None)
+                lock.report_outcome(outcome)